@@ -0,0 +1,138 @@
+"""
+Helpers shared by Step 6, the Step 7 filters and the combined runner:
+regex/keyword helpers, lowercased text columns and the CSV/Parquet readers and writers
+"""
+
+import os
+import re
+import pandas as pd
+
+try:
+    import re2
+except ImportError:  # google-re2 is an optional speed-up
+    re2 = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow enables the Parquet intermediates and faster CSV parsing/writing
+    pa = pacsv = pq = None
+
+# Arrow-backed strings: .str.lower()/.str.contains() run as pyarrow compute kernels
+TEXT_DTYPE = pd.ArrowDtype(pa.string()) if pa is not None else object
+
+# pandas' default na_values, so pyarrow's CSV reader marks the same fields missing
+CSV_NA_VALUES = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+                 '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null']
+
+# ============================================
+# KEYWORD HELPERS
+# ============================================
+
+def lower_pattern(pattern):
+    """Lowercase a regex for matching lowercased text (escapes such as \\B, \\S, \\W, \\D are kept)"""
+    return re.sub(r'\\.|[^\\]+', lambda m: m.group() if m.group()[0] == '\\' else m.group().lower(), pattern)
+
+def compile_keyword_set(patterns):
+    """Compile (lowercased) patterns into one RE2 set (a single DFA)"""
+    keyword_set = re2.Set.SearchSet(re2.Options())
+    for pattern in patterns:
+        keyword_set.Add(pattern)
+    keyword_set.Compile()
+    return keyword_set
+
+def literal_core(pattern):
+    """Lowercased literal of a r'\bliteral\b' pattern, or None if it is a real regex"""
+    core = pattern[2:-2] if pattern.startswith(r'\b') and pattern.endswith(r'\b') else ''
+    if not core or any(char in core for char in '\\.^$*+?()[]{}|'):
+        return None
+    return core.lower()
+
+def keyword_hits(text, pattern):
+    """
+    Boolean array: which rows of a lowercased text column match one keyword
+    Literal keywords are first located with a plain substring search and the
+    regex (for the word boundaries) only runs on those candidate rows
+    """
+    literal = literal_core(pattern)
+    if literal is None:
+        return text.str.contains(pattern).to_numpy(dtype=bool)
+    hits = text.str.contains(literal, regex=False).to_numpy(dtype=bool, copy=True)
+    hits[hits] = text[hits].str.contains(pattern).to_numpy(dtype=bool)
+    return hits
+
+# ============================================
+# TEXT COLUMNS
+# ============================================
+
+def lowercase_text(column):
+    """Lowercased TEXT_DTYPE copy of a text column ('' where missing)"""
+    if not isinstance(column.dtype, (pd.StringDtype, pd.ArrowDtype)):
+        # Other columns (object, or float64 when read entirely empty) go through str() per value
+        column = column.astype(object).fillna('').astype(str)
+    return column.fillna('').astype(TEXT_DTYPE).str.lower()
+
+def get_text_columns(df, columns=('Title', 'Abstract', 'Keywords')):
+    """Extract lowercased text columns (default: Title, Abstract, and Keywords; '' where missing)"""
+    return tuple(lowercase_text(df[col]) if col in df.columns else pd.Series('', index=df.index, dtype=TEXT_DTYPE)
+                 for col in columns)
+
+# ============================================
+# CSV / PARQUET FILES
+# ============================================
+
+def parquet_path(csv_path):
+    """Path of the Parquet copy written next to an intermediate CSV"""
+    return os.path.splitext(csv_path)[0] + '.parquet'
+
+def read_csv_file(input_csv, usecols=None, as_strings=False):
+    """
+    Parse a CSV with pyarrow's multithreaded reader when installed, otherwise pandas' C parser
+    Quoted fields may span lines (abstracts often contain line breaks): pandas' pyarrow
+    engine cannot split such files into blocks, so pyarrow.csv is called with newlines_in_values.
+    as_strings reads the usecols as strings (dtype=str)
+    """
+    if pa is None:
+        return pd.read_csv(input_csv, usecols=usecols, dtype=str if as_strings else None, low_memory=False)
+    convert_options = pacsv.ConvertOptions(
+        include_columns=usecols, null_values=CSV_NA_VALUES, strings_can_be_null=True,
+        column_types={col: pa.string() for col in usecols} if as_strings else None)
+    table = pacsv.read_csv(input_csv, parse_options=pacsv.ParseOptions(newlines_in_values=True),
+                           convert_options=convert_options)
+    # Columns without any value are read as float64 (all NaN), as pandas does
+    table = table.cast(pa.schema([field.with_type(pa.float64()) if pa.types.is_null(field.type) else field
+                                  for field in table.schema]))
+    return table.to_pandas()
+
+def read_papers(input_csv, columns=None):
+    """
+    Load the input papers (all columns, or those of the given columns that are present)
+    Reads the Parquet copy written by the previous filter when it is not older
+    than the CSV (and pyarrow is installed), otherwise parses the CSV
+    (with pyarrow's multithreaded parser when installed; selected columns are read as strings)
+    """
+    if pa is not None:
+        parquet_file = parquet_path(input_csv)
+        if os.path.exists(parquet_file) and os.path.getmtime(parquet_file) >= os.path.getmtime(input_csv):
+            if columns is None:
+                return pd.read_parquet(parquet_file)
+            return pd.read_parquet(parquet_file, columns=[col for col in pq.read_schema(parquet_file).names
+                                                          if col in columns])
+    if columns is None:
+        return read_csv_file(input_csv)
+
+    # Only the header is parsed to find which of the columns are present
+    usecols = [col for col in pd.read_csv(input_csv, nrows=0).columns if col in columns]
+    return read_csv_file(input_csv, usecols, as_strings=True)
+
+def append_csv(df, output_file, header):
+    """
+    Append a DataFrame to an open CSV file (no index, UTF-8)
+    Uses pyarrow's C++ CSV writer, which releases the GIL, when installed
+    """
+    if pacsv is None:
+        df.to_csv(output_file, header=header, index=False, encoding='utf-8')
+        return
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    pacsv.write_csv(table, output_file, write_options=pacsv.WriteOptions(include_header=header))
@@ -3,10 +3,20 @@ PRISMA-style screening and filtering for ICD coding literature
 Categorizes papers by relevance using automated criteria
 """
 
+import os
 import pandas as pd
+import numpy as np
 import re
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 
+from pipeline_utils import TEXT_DTYPE, get_text_columns, lower_pattern, read_csv_file
+
+try:
+    import xlsxwriter
+except ImportError:  # streaming Excel output is an optional speed-up (openpyxl is used otherwise)
+    xlsxwriter = None
+
 # ============================================
 # STEP 1: Define Inclusion/Exclusion Criteria
 # ============================================
@@ -55,8 +65,8 @@ AI_ML_TERMS = [
     r'\bknowledge graph\b',
     r'\bontology\b',
     r'\bembedding\b',
-    r'\bfine-tun(e|ing)\b',
-    r'\bpre-train(ed|ing)\b'
+    r'\bfine-tun(?:e|ing)\b',
+    r'\bpre-train(?:ed|ing)\b'
 ]
 
 # Exclusion terms (papers NOT about ICD coding automation)
@@ -89,52 +99,60 @@ EXCLUSION_TERMS = [
     r'\bguideline\b'
 ]
 
+# Title/Abstract/Keywords are held as Arrow strings when pyarrow is installed,
+# so .str.lower()/.str.contains run as compiled Arrow kernels over the column
+TEXT_COLUMNS = ['Title', 'Abstract', 'Keywords']
+
+# Matching runs on lowercased text, so the terms are lowercased once here
+# instead of case-folding with re.IGNORECASE / case=False on every search
+ICD_PATTERNS = [lower_pattern(term) for term in ICD_TERMS]
+AI_ML_PATTERNS = [lower_pattern(term) for term in AI_ML_TERMS]
+EXCLUSION_PATTERNS = [lower_pattern(term) for term in EXCLUSION_TERMS]
+
 # ============================================
 # STEP 2: Helper Functions
 # ============================================
 
-def combine_text_fields(row):
-    """Combine Title, Abstract, and Keywords for searching"""
-    text = ''
-    if pd.notna(row.get('Title')):
-        text += str(row['Title']).lower() + ' '
-    if pd.notna(row.get('Abstract')):
-        text += str(row['Abstract']).lower() + ' '
-    if pd.notna(row.get('Keywords')):
-        text += str(row['Keywords']).lower() + ' '
+def to_text_column(values):
+    """Convert a column to TEXT_DTYPE strings, keeping missing values missing"""
+    return values.where(values.isna(), values.astype(str)).astype(TEXT_DTYPE)
+
+def combine_text_columns(*columns):
+    """Combine lowercased Title, Abstract, and Keywords columns for searching"""
+    text = pd.Series('', index=columns[0].index, dtype=TEXT_DTYPE)
+    for column in columns:
+        text = text + (column + ' ').where(column != '', '')
     return text
 
 def contains_any_pattern(text, patterns):
-    """Check if text contains any of the regex patterns"""
+    """Check if (lowercased) text contains any of the lowercased regex patterns"""
     if pd.isna(text) or text == '':
         return False
     for pattern in patterns:
-        if re.search(pattern, text, re.IGNORECASE):
+        if re.search(pattern, text):
             return True
     return False
 
 def count_pattern_matches(text, patterns):
-    """Count how many patterns match in the text"""
-    if pd.isna(text) or text == '':
-        return 0
-    count = 0
+    """Count how many lowercased patterns match in each row of a lowercased text column"""
+    counts = pd.Series(0, index=text.index)
     for pattern in patterns:
-        if re.search(pattern, text, re.IGNORECASE):
-            count += 1
-    return count
+        counts += text.str.contains(pattern).astype(int)
+    return counts
 
-def score_relevance(row):
-    """Calculate relevance score for each paper"""
-    text = combine_text_fields(row)
-    title = str(row.get('Title', '')).lower() if pd.notna(row.get('Title')) else ''
-    abstract = str(row.get('Abstract', '')).lower() if pd.notna(row.get('Abstract')) else ''
+def score_relevance(title, abstract, text, ai_count, exclusion_count):
+    """
+    Calculate relevance score for each paper
+    Takes the lowercased title, abstract and combined text of one row, plus
+    its AI/ML and exclusion term counts from count_pattern_matches
+    """
 
     score = 0
     reasons = []
 
     # Check for ICD terms
-    icd_in_title = contains_any_pattern(title, ICD_TERMS)
-    icd_in_abstract = contains_any_pattern(abstract, ICD_TERMS)
+    icd_in_title = contains_any_pattern(title, ICD_PATTERNS)
+    icd_in_abstract = contains_any_pattern(abstract, ICD_PATTERNS)
 
     if icd_in_title:
         score += 10
@@ -148,47 +166,68 @@ def score_relevance(row):
         reasons.append("No ICD terms found")
 
     # Check for AI/ML terms
-    ai_count = count_pattern_matches(text, AI_ML_TERMS)
     ai_score = min(ai_count * 2, 10)  # Max 10 points for AI/ML
     score += ai_score
     if ai_count > 0:
         reasons.append(f"{ai_count} AI/ML terms (+{ai_score})")
 
     # Check for exclusion terms
-    exclusion_count = count_pattern_matches(text, EXCLUSION_TERMS)
     if exclusion_count > 0:
         penalty = min(exclusion_count * 5, 15)
         score -= penalty
         reasons.append(f"Contains {exclusion_count} exclusion terms (-{penalty})")
 
     # Boost for specific highly relevant terms in title
-    if re.search(r'automat(ed|ic|ion).*ICD|ICD.*automat', title, re.IGNORECASE):
+    if re.search(r'automat(ed|ic|ion).*icd|icd.*automat', title):
         score += 5
         reasons.append("Automated ICD in title (+5)")
 
     # Boost for "code assignment", "coding task", etc.
-    if re.search(r'(code|coding)\s+(assignment|task|prediction|generation)', title, re.IGNORECASE):
+    if re.search(r'(code|coding)\s+(assignment|task|prediction|generation)', title):
         score += 3
         reasons.append("Coding task terminology (+3)")
 
     # Check for evaluation metrics (indicates technical paper)
-    metrics = r'\b(F1|precision|recall|accuracy|AUC|AUROC|evaluation|performance|benchmark)\b'
-    if re.search(metrics, text, re.IGNORECASE):
+    metrics = r'\b(f1|precision|recall|accuracy|auc|auroc|evaluation|performance|benchmark)\b'
+    if re.search(metrics, text):
         score += 2
         reasons.append("Has evaluation metrics (+2)")
 
     return score, '; '.join(reasons)
 
-def categorize_paper(score):
-    """Categorize paper based on relevance score"""
-    if score >= 15:
-        return 'HIGH - Definite Include'
-    elif score >= 8:
-        return 'MEDIUM - Review Abstract'
-    elif score >= 0:
-        return 'LOW - Likely Exclude'
-    else:
-        return 'EXCLUDE - Clear Exclusion'
+def score_block(chunk):
+    """Score a block of rows (run in a worker process by score_papers)"""
+    # Lowercase and combine each text column once for the whole block
+    title_lc, abs_lc, kw_lc = get_text_columns(chunk, TEXT_COLUMNS)
+    all_lc = combine_text_columns(title_lc, abs_lc, kw_lc)
+    ai_counts = count_pattern_matches(all_lc, AI_ML_PATTERNS)
+    exclusion_counts = count_pattern_matches(all_lc, EXCLUSION_PATTERNS)
+
+    scores = [score_relevance(*fields)
+              for fields in zip(title_lc, abs_lc, all_lc, ai_counts, exclusion_counts)]
+    return pd.DataFrame(scores, index=chunk.index, columns=['relevance_score', 'reasons'])
+
+def score_papers(df, n_jobs=None):
+    """
+    Calculate relevance scores for all rows, splitting the DataFrame into
+    n_jobs blocks scored in parallel (df.apply alone is single-threaded)
+    """
+    n_jobs = n_jobs or os.cpu_count() or 1
+    if n_jobs == 1 or len(df) < 2 * n_jobs:
+        return score_block(df)
+
+    blocks = [df.iloc[idx] for idx in np.array_split(np.arange(len(df)), n_jobs)]
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        return pd.concat(executor.map(score_block, blocks))
+
+def categorize_papers(scores):
+    """
+    Categorize papers based on relevance score
+    Score bands: >= 15 HIGH, >= 8 MEDIUM, >= 0 LOW, otherwise EXCLUDE
+    """
+    return pd.cut(scores, bins=[-np.inf, 0, 8, 15, np.inf], right=False,
+                  labels=['EXCLUDE - Clear Exclusion', 'LOW - Likely Exclude',
+                          'MEDIUM - Review Abstract', 'HIGH - Definite Include'])
 
 def write_ris_file(df, output_file):
     """
@@ -212,40 +251,75 @@ def write_ris_file(df, output_file):
         'Issue': 'IS'
     }
 
+    # Resolve column positions once from the schema rather than per row
+    fields = [(df.columns.get_loc(col), tag, col in ('Authors', 'Keywords'))
+              for col, tag in column_to_ris_tag.items() if col in df.columns]
+    score_idx = df.columns.get_loc('relevance_score') if 'relevance_score' in df.columns else None
+    category_idx = df.columns.get_loc('category') if 'category' in df.columns else None
+    reasons_idx = df.columns.get_loc('reasons') if 'reasons' in df.columns else None
+
     with open(output_file, 'w', encoding='utf-8') as f:
-        for _, row in df.iterrows():
+        for row in df.itertuples(index=False, name=None):
             # Write each field if it exists and has a value
-            for col, tag in column_to_ris_tag.items():
-                if col in row and pd.notna(row[col]) and str(row[col]).strip():
-                    value = str(row[col])
-
-                    # Handle multiple values (like multiple authors separated by semicolon)
-                    if col == 'Authors' and ';' in value:
-                        authors = [a.strip() for a in value.split(';') if a.strip()]
-                        for author in authors:
-                            f.write(f"{tag}  - {author}\n")
-                    elif col == 'Keywords' and ';' in value:
-                        keywords = [k.strip() for k in value.split(';') if k.strip()]
-                        for keyword in keywords:
-                            f.write(f"KW  - {keyword}\n")
-                    else:
-                        f.write(f"{tag}  - {value}\n")
+            for idx, tag, is_multi_value in fields:
+                value = row[idx]
+                if pd.isna(value) or not str(value).strip():
+                    continue
+                value = str(value)
+
+                # Handle multiple values (like multiple authors separated by semicolon)
+                if is_multi_value and ';' in value:
+                    values = [v.strip() for v in value.split(';') if v.strip()]
+                    for v in values:
+                        f.write(f"{tag}  - {v}\n")
+                else:
+                    f.write(f"{tag}  - {value}\n")
 
             # Add relevance score and category as notes
-            if 'relevance_score' in row and pd.notna(row['relevance_score']):
-                f.write(f"N1  - [PRISMA] Score: {row['relevance_score']} | Category: {row['category']}\n")
-            if 'reasons' in row and pd.notna(row['reasons']):
-                f.write(f"N1  - [PRISMA] Reasons: {row['reasons']}\n")
+            if score_idx is not None and pd.notna(row[score_idx]):
+                f.write(f"N1  - [PRISMA] Score: {row[score_idx]} | Category: {row[category_idx]}\n")
+            if reasons_idx is not None and pd.notna(row[reasons_idx]):
+                f.write(f"N1  - [PRISMA] Reasons: {row[reasons_idx]}\n")
 
             # End of record
             f.write("ER  - \n\n")
 
+def write_excel_sheets(output_excel, sheets):
+    """
+    Write {sheet_name: DataFrame} to an Excel workbook
+    Uses xlsxwriter's constant_memory mode, which flushes each row to disk as
+    soon as the next one starts, so rows are written strictly in order
+    (pandas' to_excel writes column by column and would lose cells).
+    Without xlsxwriter, the sheets are written with pandas' openpyxl engine
+    """
+    if xlsxwriter is None:
+        with pd.ExcelWriter(output_excel, engine='openpyxl') as writer:
+            for sheet_name, df in sheets.items():
+                df.to_excel(writer, sheet_name=sheet_name, index=False)
+        return
+
+    workbook = xlsxwriter.Workbook(output_excel, {
+        'constant_memory': True,
+        'strings_to_formulas': False,
+        'strings_to_urls': False
+    })
+    header_format = workbook.add_format({'bold': True})
+
+    for sheet_name, df in sheets.items():
+        worksheet = workbook.add_worksheet(sheet_name)
+        worksheet.write_row(0, 0, list(df.columns), header_format)
+        values = df.astype(object).where(df.notna(), None)
+        for row_idx, row in enumerate(values.itertuples(index=False, name=None), start=1):
+            worksheet.write_row(row_idx, 0, row)
+
+    workbook.close()
+
 # ============================================
 # STEP 3: Main Processing Function
 # ============================================
 
 def screen_papers(input_csv, output_excel='prisma_screening_results.xlsx',
-                  year_start=2005, year_end=2026):
+                  year_start=2005, year_end=2026, n_jobs=None):
     """
     Main function to screen papers using PRISMA-style criteria
 
@@ -254,6 +328,7 @@ def screen_papers(input_csv, output_excel='prisma_screening_results.xlsx',
     - output_excel: Output Excel file with categorized results
     - year_start: Start year for filtering (default 2005)
     - year_end: End year for filtering (default 2026)
+    - n_jobs: Worker processes for relevance scoring (default: all CPU cores)
     """
 
     print("="*80)
@@ -262,9 +337,13 @@ def screen_papers(input_csv, output_excel='prisma_screening_results.xlsx',
 
     # Load the data
     print(f"\nLoading data from {input_csv}...")
-    df = pd.read_csv(input_csv, low_memory=False)
+    df = read_csv_file(input_csv)  # pyarrow's multithreaded CSV parser when installed
     print(f"Total records loaded: {len(df):,}")
 
+    for column in TEXT_COLUMNS:
+        if column in df.columns:
+            df[column] = to_text_column(df[column])
+
     # Convert Year to numeric, handling any non-numeric values
     df['Year'] = pd.to_numeric(df['Year'], errors='coerce')
 
@@ -275,30 +354,33 @@ def screen_papers(input_csv, output_excel='prisma_screening_results.xlsx',
     # STEP 4: Apply Filters
     # ============================================
 
+    # Both filters are combined into one mask, so the rows are selected (and
+    # copied, as score columns are added below) once instead of once per filter
+
     # Year filter
-    df_filtered = df[df['Year'].between(year_start, year_end, inclusive='both')].copy()
-    after_year = len(df_filtered)
+    keep = df['Year'].between(year_start, year_end, inclusive='both').to_numpy()
+    after_year = int(keep.sum())
     print(f"After year filter ({year_start}-{year_end}): {after_year:,}")
     print(f"  Excluded (outside date range): {total_original - after_year:,}")
 
     # Publication type filter (keep CONF and JOUR if Type column exists)
-    if 'Type' in df_filtered.columns:
-        df_filtered = df_filtered[df_filtered['Type'].isin(['CONF', 'JOUR'])].copy()
-        after_pubtype = len(df_filtered)
+    if 'Type' in df.columns:
+        keep = keep & df['Type'].isin(['CONF', 'JOUR']).to_numpy()
+        after_pubtype = int(keep.sum())
         print(f"After publication type filter (CONF/JOUR): {after_pubtype:,}")
         print(f"  Excluded (non-CONF/JOUR): {after_year - after_pubtype:,}")
     else:
         after_pubtype = after_year
         print("Note: 'Type' column not found, skipping publication type filter")
 
+    df_filtered = df[keep].copy()
+
     # Calculate relevance scores
     print("\nCalculating relevance scores...")
-    df_filtered[['relevance_score', 'reasons']] = df_filtered.apply(
-        lambda row: pd.Series(score_relevance(row)), axis=1
-    )
+    df_filtered[['relevance_score', 'reasons']] = score_papers(df_filtered, n_jobs)
 
     # Categorize papers
-    df_filtered['category'] = df_filtered['relevance_score'].apply(categorize_paper)
+    df_filtered['category'] = categorize_papers(df_filtered['relevance_score'])
 
     # ============================================
     # STEP 5: Generate PRISMA Numbers
@@ -331,40 +413,41 @@ def screen_papers(input_csv, output_excel='prisma_screening_results.xlsx',
 
     print(f"\nExporting results to {output_excel}...")
 
-    # Sort by relevance score (highest first)
-    df_filtered_sorted = df_filtered.sort_values('relevance_score', ascending=False)
-
-    # Split by category
-    df_high = df_filtered_sorted[df_filtered_sorted['category'] == 'HIGH - Definite Include']
-    df_medium = df_filtered_sorted[df_filtered_sorted['category'] == 'MEDIUM - Review Abstract']
-    df_low = df_filtered_sorted[df_filtered_sorted['category'] == 'LOW - Likely Exclude']
-    df_exclude = df_filtered_sorted[df_filtered_sorted['category'] == 'EXCLUDE - Clear Exclusion']
+    # Split by category, then sort each group by relevance score (highest first).
+    # Categories are score bands, so the groups concatenated in band order are
+    # already the full list sorted by score - no sort over all rows is needed
+    category = df_filtered['category']
+    df_high = df_filtered[category == 'HIGH - Definite Include'].sort_values('relevance_score', ascending=False)
+    df_medium = df_filtered[category == 'MEDIUM - Review Abstract'].sort_values('relevance_score', ascending=False)
+    df_low = df_filtered[category == 'LOW - Likely Exclude'].sort_values('relevance_score', ascending=False)
+    df_exclude = df_filtered[category == 'EXCLUDE - Clear Exclusion'].sort_values('relevance_score', ascending=False)
+    df_filtered_sorted = pd.concat([df_high, df_medium, df_low, df_exclude])
+
+    # Summary sheet
+    summary_data = {
+        'Category': ['HIGH - Definite Include', 'MEDIUM - Review Abstract',
+                     'LOW - Likely Exclude', 'EXCLUDE - Clear Exclusion', 'TOTAL'],
+        'Count': [len(df_high), len(df_medium), len(df_low), len(df_exclude), len(df_filtered_sorted)],
+        'Percentage': [
+            f"{(len(df_high)/len(df_filtered_sorted)*100):.1f}%",
+            f"{(len(df_medium)/len(df_filtered_sorted)*100):.1f}%",
+            f"{(len(df_low)/len(df_filtered_sorted)*100):.1f}%",
+            f"{(len(df_exclude)/len(df_filtered_sorted)*100):.1f}%",
+            "100.0%"
+        ]
+    }
 
     # Save to Excel with multiple sheets
-    with pd.ExcelWriter(output_excel, engine='openpyxl') as writer:
-        # Summary sheet
-        summary_data = {
-            'Category': ['HIGH - Definite Include', 'MEDIUM - Review Abstract',
-                         'LOW - Likely Exclude', 'EXCLUDE - Clear Exclusion', 'TOTAL'],
-            'Count': [len(df_high), len(df_medium), len(df_low), len(df_exclude), len(df_filtered_sorted)],
-            'Percentage': [
-                f"{(len(df_high)/len(df_filtered_sorted)*100):.1f}%",
-                f"{(len(df_medium)/len(df_filtered_sorted)*100):.1f}%",
-                f"{(len(df_low)/len(df_filtered_sorted)*100):.1f}%",
-                f"{(len(df_exclude)/len(df_filtered_sorted)*100):.1f}%",
-                "100.0%"
-            ]
-        }
-        pd.DataFrame(summary_data).to_excel(writer, sheet_name='Summary', index=False)
-
+    write_excel_sheets(output_excel, {
+        'Summary': pd.DataFrame(summary_data),
         # Category sheets
-        df_high.to_excel(writer, sheet_name='High_Relevance', index=False)
-        df_medium.to_excel(writer, sheet_name='Medium_Relevance', index=False)
-        df_low.to_excel(writer, sheet_name='Low_Relevance', index=False)
-        df_exclude.to_excel(writer, sheet_name='Excluded', index=False)
-
+        'High_Relevance': df_high,
+        'Medium_Relevance': df_medium,
+        'Low_Relevance': df_low,
+        'Excluded': df_exclude,
         # All filtered results
-        df_filtered_sorted.to_excel(writer, sheet_name='All_Filtered', index=False)
+        'All_Filtered': df_filtered_sorted
+    })
 
     print(f"\n[SUCCESS] Results exported to {output_excel}")
     print("\nSheets created:")
@@ -6,10 +6,22 @@ Input: prisma_screening_results_all_filtered.csv (papers filtered by year 2005-2
 Output: Papers that do not mention non-medical meanings of ICD (cardiac devices, etc.)
 """
 
+import contextlib
 import pandas as pd
 import re
+import shutil
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+from pipeline_utils import append_csv, get_text_columns, lower_pattern, parquet_path
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow's Parquet writer is an optional speed-up
+    pa = pq = None
+
 # ============================================
 # EXCLUSION KEYWORDS (If found, paper is excluded)
 # ============================================
@@ -23,33 +35,30 @@ EXCLUSION_KEYWORDS = {
     'Security/Intelligence': r'\b(intelligence community directive|insecure code detector)\b'  # ICD = Intelligence Community Directive / Insecure Code Detector
 }
 
+# Compiled once at import instead of on every re.search call. The text is
+# lowercased before matching, so the patterns are lowercased instead of using IGNORECASE
+EXCLUSION_PATTERNS = [(name, re.compile(lower_pattern(pattern))) for name, pattern in EXCLUSION_KEYWORDS.items()]
+
+# Rows read from the input CSV per chunk
+CHUNK_SIZE = 50_000
+
+# Decisions are stored as a categorical (one byte code per row)
+DECISION_DTYPE = pd.CategoricalDtype(['PASS', 'EXCLUDE'])
+
 # ============================================
 # HELPER FUNCTIONS
 # ============================================
 
-def get_text_from_row(row):
-    """Extract and combine Title, Abstract, and Keywords"""
-    title = str(row.get('Title', '')).lower() if pd.notna(row.get('Title')) else ''
-    abstract = str(row.get('Abstract', '')).lower() if pd.notna(row.get('Abstract')) else ''
-    keywords = str(row.get('Keywords', '')).lower() if pd.notna(row.get('Keywords')) else ''
-
-    return title, abstract, keywords
-
 def find_exclusion_keywords(text):
     """Find all exclusion keywords that match in the text"""
-    matches = []
-    for keyword_name, pattern in EXCLUSION_KEYWORDS.items():
-        if re.search(pattern, text, re.IGNORECASE):
-            matches.append(keyword_name)
-    return matches
+    return [keyword_name for keyword_name, pattern in EXCLUSION_PATTERNS if pattern.search(text)]
 
-def check_exclusion_criteria(row):
+def check_exclusion_criteria(title, abstract, keywords):
     """
     Check if paper should be excluded based on exclusion keywords
+    Takes the lowercased title, abstract and keywords of one paper
     Returns: (decision, matched_terms, reason)
     """
-    title, abstract, keywords = get_text_from_row(row)
-
     # Check if all fields are empty
     if not title and not abstract and not keywords:
         return 'EXCLUDE', '', 'No title, abstract, or keywords available for evaluation'
@@ -69,6 +78,19 @@ def check_exclusion_criteria(row):
     reason = "Paper does not contain non-medical ICD terms (cardiac devices, quantum computing, etc.). Passes Filter 1 and proceeds to Filter 2 for ICD relevance check."
     return 'PASS', '', reason
 
+def append_parquet(df, writer):
+    """Append a DataFrame to an open Parquet file (columns stored as strings)"""
+    writer.write_table(pa.Table.from_pandas(df, schema=writer.schema, preserve_index=False))
+
+def concatenate_csv(output_file, input_files):
+    """Join CSV files that share a header into one file (header kept once)"""
+    with open(output_file, 'wb') as out:
+        for i, input_file in enumerate(input_files):
+            with open(input_file, 'rb') as f:
+                if i > 0:
+                    f.readline()  # skip the repeated header
+                shutil.copyfileobj(f, out)
+
 # ============================================
 # MAIN FILTERING FUNCTION
 # ============================================
@@ -76,7 +98,8 @@ def check_exclusion_criteria(row):
 def filter_exclusion_criteria(input_csv='prisma_screening_results_all_filtered.csv',
                               output_all='filter1_all_results.csv',
                               output_pass='filter1_passed.csv',
-                              output_exclude='filter1_excluded.csv'):
+                              output_exclude='filter1_excluded.csv',
+                              verbose=False, decisions_only=False, return_papers=False):
     """
     Filter 1: Check for non-medical ICD exclusion criteria
 
@@ -85,6 +108,13 @@ def filter_exclusion_criteria(input_csv='prisma_screening_results_all_filtered.c
     - output_all: Complete results with all papers and Filter 1 decisions
     - output_pass: Papers that PASSED (no non-medical ICD terms) - proceed to Filter 2
     - output_exclude: Papers that were EXCLUDED (contain non-medical ICD terms like cardiac devices)
+    - verbose: Print sample passed/excluded papers (default: off)
+    - decisions_only: Write only the row key (Row, DOI) and the Filter1 columns to output_all
+    - return_papers: Return the annotated papers (all input columns plus the Filter 1 columns)
+      instead of the counts; this holds the whole input in memory (default: off)
+
+    Returns: dict with the total/passed/excluded counts, the exclusion keyword counts
+    and the sample passed/excluded papers (or the annotated papers, see return_papers)
     """
 
     print("="*80)
@@ -94,29 +124,85 @@ def filter_exclusion_criteria(input_csv='prisma_screening_results_all_filtered.c
     print("Action: If exclusion keywords found -> EXCLUDE")
     print("Checking: Title AND Abstract AND Keywords for exclusion terms")
 
-    # Load data
-    print(f"\nLoading data from {input_csv}...")
-    df = pd.read_csv(input_csv, low_memory=False)
-    print(f"Total records loaded: {len(df):,}")
-    print("(Papers after year and publication type filtering)")
+    # Select columns for output
+    output_columns = [
+        'Filter1_Decision', 'Filter1_Matched_Exclusions', 'Filter1_Reason',
+        'Title', 'Authors', 'Year', 'Publication', 'Type', 'DOI', 'Abstract', 'Keywords', 'URL'
+    ]
+    filter_columns = output_columns[:3]
 
     # ============================================
-    # APPLY EXCLUSION CRITERIA FILTER
+    # APPLY EXCLUSION CRITERIA FILTER (in chunks)
     # ============================================
 
+    # The input is streamed in chunks of CHUNK_SIZE rows: each chunk is filtered and
+    # appended to the PASS / EXCLUDE files, so memory stays bounded by one chunk.
+    # Columns are read as strings so every chunk has the same Parquet schema
+    print(f"\nLoading data from {input_csv} in chunks of {CHUNK_SIZE:,} rows...")
+    print("(Papers after year and publication type filtering)")
+
     print("\n" + "-"*80)
     print("Applying Exclusion Criteria Filter...")
     print("-"*80)
 
-    # Apply the filter
-    results = df.apply(check_exclusion_criteria, axis=1)
-    df['Filter1_Decision'] = results.apply(lambda x: x[0])
-    df['Filter1_Matched_Exclusions'] = results.apply(lambda x: x[1])
-    df['Filter1_Reason'] = results.apply(lambda x: x[2])
-
-    # Count results
-    passed_count = (df['Filter1_Decision'] == 'PASS').sum()
-    excluded_count = (df['Filter1_Decision'] == 'EXCLUDE').sum()
+    total_count = passed_count = excluded_count = 0
+    exclusion_counts = Counter()
+    annotated = []
+    sample_passed = []
+    sample_excluded = []
+
+    # With decisions_only the all-results file is written chunk by chunk as well;
+    # otherwise it is joined from the PASS and EXCLUDE files at the end
+    decisions_file = (open(output_all, 'w', newline='', encoding='utf-8') if decisions_only
+                      else contextlib.nullcontext())
+    with open(output_pass, 'wb') as pass_file, open(output_exclude, 'wb') as exclude_file, decisions_file, \
+            ThreadPoolExecutor(max_workers=3) as executor:
+        writes = []
+        parquet_writer = None
+        reader = pd.read_csv(input_csv, dtype=str, chunksize=CHUNK_SIZE)
+        for i, chunk in enumerate(reader):
+            # Fields are lowercased column-wise once, then checked row by row
+            results = [check_exclusion_criteria(*fields) for fields in zip(*get_text_columns(chunk))]
+            chunk[filter_columns] = pd.DataFrame(results, index=chunk.index, columns=filter_columns)
+            chunk['Filter1_Decision'] = chunk['Filter1_Decision'].astype(DECISION_DTYPE)
+            chunk_columns = [col for col in output_columns if col in chunk.columns]
+            passed = (chunk['Filter1_Decision'] == 'PASS').to_numpy()
+            if pq is not None and parquet_writer is None:
+                # Filter 2 reads this Parquet copy of the PASS file instead of re-parsing the CSV
+                schema = pa.schema([(col, pa.string()) for col in chunk_columns])
+                parquet_writer = pq.ParquetWriter(parquet_path(output_pass), schema, compression='snappy')
+
+            # The previous chunk's writes must finish before this chunk is appended
+            for write in writes:
+                write.result()
+            # Written concurrently with the next chunk's filtering (pyarrow writes without the GIL)
+            writes = [executor.submit(append_csv, chunk.loc[passed, chunk_columns], pass_file, i == 0),
+                      executor.submit(append_csv, chunk.loc[~passed, chunk_columns], exclude_file, i == 0)]
+            if parquet_writer is not None:
+                writes.append(executor.submit(append_parquet, chunk.loc[passed, chunk_columns], parquet_writer))
+            if decisions_only:
+                # Only the decisions, keyed by input row (Row) and DOI
+                decision_columns = [col for col in ['DOI'] if col in chunk.columns] + filter_columns
+                chunk[decision_columns].to_csv(decisions_file, header=i == 0, index_label='Row')
+
+            total_count += len(chunk)
+            passed_count += int(passed.sum())
+            excluded_count += int((~passed).sum())
+            exclusion_counts.update(chunk.loc[~passed, 'Filter1_Matched_Exclusions']
+                                    .str.split('; ').explode().dropna())
+            if return_papers:
+                annotated.append(chunk)
+            if len(sample_passed) < 5:
+                sample_passed.extend(chunk.loc[passed].head(5 - len(sample_passed)).to_dict('records'))
+            if len(sample_excluded) < 3:
+                sample_excluded.extend(chunk.loc[~passed].head(3 - len(sample_excluded)).to_dict('records'))
+        for write in writes:
+            write.result()
+    # Closed after the CSV so the Parquet copy is never older than it
+    if parquet_writer is not None:
+        parquet_writer.close()
+
+    print(f"Total records loaded: {total_count:,}")
 
     # ============================================
     # DISPLAY RESULTS
@@ -125,20 +211,16 @@ def filter_exclusion_criteria(input_csv='prisma_screening_results_all_filtered.c
     print("\n" + "="*80)
     print("FILTER 1 RESULTS: EXCLUSION CRITERIA")
     print("="*80)
-    print(f"\nTotal papers evaluated: {len(df):,}")
-    print(f"\n  [PASS] PASSED (no exclusion keywords):  {passed_count:,} ({passed_count/len(df)*100:.1f}%)")
-    print(f"  [EXCLUDE] EXCLUDED (has exclusion keywords): {excluded_count:,} ({excluded_count/len(df)*100:.1f}%)")
+    print(f"\nTotal papers evaluated: {total_count:,}")
+    print(f"\n  [PASS] PASSED (no exclusion keywords):  {passed_count:,} ({passed_count/max(total_count, 1)*100:.1f}%)")
+    print(f"  [EXCLUDE] EXCLUDED (has exclusion keywords): {excluded_count:,} ({excluded_count/max(total_count, 1)*100:.1f}%)")
 
     # Show exclusion reasons (for excluded papers)
     if excluded_count > 0:
         print("\n" + "-"*80)
         print("Top Exclusion Reasons:")
         print("-"*80)
-        # Get top exclusion keywords
-        all_exclusions = df[df['Filter1_Decision'] == 'EXCLUDE']['Filter1_Matched_Exclusions'].str.split('; ')
-        exclusion_list = [item for sublist in all_exclusions if isinstance(sublist, list) for item in sublist]
-        from collections import Counter
-        exclusion_counts = Counter(exclusion_list)
+        # Get top exclusion keywords (counted chunk by chunk)
         for keyword, count in exclusion_counts.most_common(10):
             print(f"  {keyword:40s}: {count:4,} papers ({count/excluded_count*100:.1f}%)")
 
@@ -146,68 +228,57 @@ def filter_exclusion_criteria(input_csv='prisma_screening_results_all_filtered.c
     # EXPORT RESULTS
     # ============================================
 
-    # Select columns for output
-    output_columns = [
-        'Filter1_Decision', 'Filter1_Matched_Exclusions', 'Filter1_Reason',
-        'Title', 'Authors', 'Year', 'Publication', 'Type', 'DOI', 'Abstract', 'Keywords', 'URL'
-    ]
-    output_columns = [col for col in output_columns if col in df.columns]
-
     print("\n" + "="*80)
     print("EXPORTING RESULTS")
     print("="*80)
 
+    if not decisions_only:
+        # PASS first, then EXCLUDE: the two streamed files joined back to back
+        concatenate_csv(output_all, [output_pass, output_exclude])
+
     # 1. Save all results
     print(f"\n1. Saving all papers with Filter 3 decisions to {output_all}...")
-    df_output = df[output_columns].copy()
-    df_output = df_output.sort_values('Filter1_Decision', ascending=False)  # PASS first
-    df_output.to_csv(output_all, index=False, encoding='utf-8')
-    print(f"   [SUCCESS] {len(df_output):,} papers saved")
+    print(f"   [SUCCESS] {total_count:,} papers saved")
 
     # 2. Save passed papers (FINAL DATASET)
-    df_passed = df[df['Filter1_Decision'] == 'PASS'].copy()
     print(f"\n2. Saving PASSED papers to {output_pass}...")
-    df_passed[output_columns].to_csv(output_pass, index=False, encoding='utf-8')
-    print(f"   [SUCCESS] {len(df_passed):,} papers saved")
+    print(f"   [SUCCESS] {passed_count:,} papers saved")
     print(f"   -> These papers proceed to Filter 2 (ICD Relevance)")
 
     # 3. Save excluded papers
-    df_excluded = df[df['Filter1_Decision'] == 'EXCLUDE'].copy()
     print(f"\n3. Saving EXCLUDED papers to {output_exclude}...")
-    df_excluded[output_columns].to_csv(output_exclude, index=False, encoding='utf-8')
-    print(f"   [SUCCESS] {len(df_excluded):,} papers saved")
+    print(f"   [SUCCESS] {excluded_count:,} papers saved")
     print(f"   -> These papers mention non-medical ICD terms (excluded)")
 
     # ============================================
-    # SAMPLE OUTPUTS
+    # SAMPLE OUTPUTS (verbose only)
     # ============================================
 
-    print("\n" + "="*80)
-    print("SAMPLE PASSED PAPERS (showing first 5)")
-    print("="*80)
-    if passed_count > 0:
-        sample_passed = df_passed.head(5)
-        for idx, row in sample_passed.iterrows():
-            title = row['Title'][:70] + '...' if len(str(row['Title'])) > 70 else row['Title']
-            print(f"\n  Title: {title}")
-            print(f"  Year: {row.get('Year', 'N/A')}")
-            print(f"  ICD Terms: {row.get('Filter1_Matched_Terms', '')[:50]}")
-            print(f"  AI Terms: {row.get('Filter2_Matched_Terms', '')[:50]}")
-    else:
-        print("  No papers passed this filter.")
-
-    print("\n" + "="*80)
-    print("SAMPLE EXCLUDED PAPERS (showing first 3)")
-    print("="*80)
-    if excluded_count > 0:
-        sample_excluded = df_excluded.head(3)
-        for idx, row in sample_excluded.iterrows():
-            title = row['Title'][:70] + '...' if len(str(row['Title'])) > 70 else row['Title']
-            print(f"\n  Title: {title}")
-            print(f"  Exclusion: {row['Filter1_Matched_Exclusions']}")
-            print(f"  Reason: {row['Filter1_Reason'][:100]}...")
-    else:
-        print("  No papers were excluded.")
+    if verbose:
+        print("\n" + "="*80)
+        print("SAMPLE PASSED PAPERS (showing first 5)")
+        print("="*80)
+        if passed_count > 0:
+            for row in sample_passed:
+                title = row['Title'][:70] + '...' if len(str(row['Title'])) > 70 else row['Title']
+                print(f"\n  Title: {title}")
+                print(f"  Year: {row.get('Year', 'N/A')}")
+                print(f"  ICD Terms: {row.get('Filter1_Matched_Terms', '')[:50]}")
+                print(f"  AI Terms: {row.get('Filter2_Matched_Terms', '')[:50]}")
+        else:
+            print("  No papers passed this filter.")
+
+        print("\n" + "="*80)
+        print("SAMPLE EXCLUDED PAPERS (showing first 3)")
+        print("="*80)
+        if excluded_count > 0:
+            for row in sample_excluded:
+                title = row['Title'][:70] + '...' if len(str(row['Title'])) > 70 else row['Title']
+                print(f"\n  Title: {title}")
+                print(f"  Exclusion: {row['Filter1_Matched_Exclusions']}")
+                print(f"  Reason: {row['Filter1_Reason'][:100]}...")
+        else:
+            print("  No papers were excluded.")
 
     # ============================================
     # FINAL SUMMARY
@@ -216,9 +287,9 @@ def filter_exclusion_criteria(input_csv='prisma_screening_results_all_filtered.c
     print("\n" + "="*80)
     print("FILTER 1 SUMMARY")
     print("="*80)
-    print(f"\nTotal papers evaluated: {len(df):,}")
-    print(f"Papers PASSED (no non-medical ICD): {passed_count:,} ({passed_count/len(df)*100:.1f}%)")
-    print(f"Papers EXCLUDED (non-medical ICD): {excluded_count:,} ({excluded_count/len(df)*100:.1f}%)")
+    print(f"\nTotal papers evaluated: {total_count:,}")
+    print(f"Papers PASSED (no non-medical ICD): {passed_count:,} ({passed_count/max(total_count, 1)*100:.1f}%)")
+    print(f"Papers EXCLUDED (non-medical ICD): {excluded_count:,} ({excluded_count/max(total_count, 1)*100:.1f}%)")
 
     print("\n" + "="*80)
     print("NEXT STEPS")
@@ -229,7 +300,17 @@ def filter_exclusion_criteria(input_csv='prisma_screening_results_all_filtered.c
     print("\nFilter 1 Complete!")
     print("="*80)
 
-    return df
+    if return_papers:
+        # The index keeps counting rows across chunks
+        return pd.concat(annotated) if annotated else pd.DataFrame(columns=filter_columns)
+    return {
+        'total': total_count,
+        'passed': passed_count,
+        'excluded': excluded_count,
+        'exclusion_counts': exclusion_counts,
+        'sample_passed': sample_passed,
+        'sample_excluded': sample_excluded,
+    }
 
 # ============================================
 # MAIN EXECUTION
@@ -244,9 +325,15 @@ if __name__ == "__main__":
     output_pass = 'filter1_passed.csv'
     output_exclude = 'filter1_excluded.csv'
 
-    # Command-line arguments
-    if len(sys.argv) > 1:
-        input_file = sys.argv[1]
+    # Command-line arguments (--verbose also prints sample papers,
+    # --decisions-only writes only the row key and decisions to the all-results file)
+    flags = [arg for arg in sys.argv[1:] if arg.startswith('--')]
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    verbose = '--verbose' in flags
+    decisions_only = '--decisions-only' in flags
+    if args:
+        input_file = args[0]
 
     # Run Filter 1
-    filter_exclusion_criteria(input_file, output_all, output_pass, output_exclude)
+    filter_exclusion_criteria(input_file, output_all, output_pass, output_exclude,
+                              verbose=verbose, decisions_only=decisions_only)
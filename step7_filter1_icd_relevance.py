@@ -10,6 +10,8 @@ import pandas as pd
 import re
 from datetime import datetime
 
+from pipeline_utils import get_text_columns, lower_pattern
+
 # ============================================
 # ICD-RELATED KEYWORDS (Mandatory)
 # ============================================
@@ -28,33 +30,28 @@ ICD_KEYWORDS = {
     'Clinical Classification': r'\bclinical classification\b'
 }
 
+# Compiled once at import instead of on every re.search call. The text is
+# lowercased before matching, so the patterns are lowercased instead of using IGNORECASE
+ICD_PATTERNS = [(name, re.compile(lower_pattern(pattern))) for name, pattern in ICD_KEYWORDS.items()]
+
+# Decisions and match locations are stored as categoricals (one byte code per row)
+DECISION_DTYPE = pd.CategoricalDtype(['PASS', 'EXCLUDE'])
+LOCATION_DTYPE = pd.CategoricalDtype(['Title', 'Abstract', 'Keywords', 'N/A'])
+
 # ============================================
 # HELPER FUNCTIONS
 # ============================================
 
-def get_text_from_row(row):
-    """Extract and combine Title, Abstract, and Keywords"""
-    title = str(row.get('Title', '')).lower() if pd.notna(row.get('Title')) else ''
-    abstract = str(row.get('Abstract', '')).lower() if pd.notna(row.get('Abstract')) else ''
-    keywords = str(row.get('Keywords', '')).lower() if pd.notna(row.get('Keywords')) else ''
-
-    return title, abstract, keywords
-
 def find_icd_keywords(text):
     """Find all ICD keywords that match in the text"""
-    matches = []
-    for keyword_name, pattern in ICD_KEYWORDS.items():
-        if re.search(pattern, text, re.IGNORECASE):
-            matches.append(keyword_name)
-    return matches
+    return [keyword_name for keyword_name, pattern in ICD_PATTERNS if pattern.search(text)]
 
-def check_icd_relevance(row):
+def check_icd_relevance(title, abstract, keywords):
     """
     Check if paper is relevant to ICD coding/classification
+    Takes the lowercased title, abstract and keywords of one paper
     Returns: (decision, matched_terms, location, reason)
     """
-    title, abstract, keywords = get_text_from_row(row)
-
     # Check if all fields are empty
     if not title and not abstract and not keywords:
         return 'EXCLUDE', '', 'N/A', 'No title, abstract, or keywords available for evaluation'
@@ -91,7 +88,8 @@ def check_icd_relevance(row):
 def filter_icd_relevance(input_csv='prisma_screening_results_all_filtered.csv',
                          output_all='filter1_all_results.csv',
                          output_pass='filter1_passed.csv',
-                         output_exclude='filter1_excluded.csv'):
+                         output_exclude='filter1_excluded.csv',
+                         verbose=False):
     """
     Filter 1: Check for ICD relevance
 
@@ -100,6 +98,7 @@ def filter_icd_relevance(input_csv='prisma_screening_results_all_filtered.csv',
     - output_all: Complete results with all papers
     - output_pass: Papers that PASSED (have ICD terms)
     - output_exclude: Papers that were EXCLUDED (no ICD terms)
+    - verbose: Print sample passed/excluded papers (default: off)
     """
 
     print("="*80)
@@ -124,15 +123,20 @@ def filter_icd_relevance(input_csv='prisma_screening_results_all_filtered.csv',
     print("-"*80)
 
     # Apply the filter
-    results = df.apply(check_icd_relevance, axis=1)
-    df['Filter1_Decision'] = results.apply(lambda x: x[0])
-    df['Filter1_Matched_Terms'] = results.apply(lambda x: x[1])
-    df['Filter1_Match_Location'] = results.apply(lambda x: x[2])
-    df['Filter1_Reason'] = results.apply(lambda x: x[3])
-
-    # Count results
-    passed_count = (df['Filter1_Decision'] == 'PASS').sum()
-    excluded_count = (df['Filter1_Decision'] == 'EXCLUDE').sum()
+    # Fields are lowercased column-wise once, then checked row by row
+    results = [check_icd_relevance(*fields) for fields in zip(*get_text_columns(df))]
+    filter_columns = ['Filter1_Decision', 'Filter1_Matched_Terms', 'Filter1_Match_Location', 'Filter1_Reason']
+    df[filter_columns] = pd.DataFrame(results, index=df.index, columns=filter_columns)
+    df['Filter1_Decision'] = df['Filter1_Decision'].astype(DECISION_DTYPE)
+    df['Filter1_Match_Location'] = df['Filter1_Match_Location'].astype(LOCATION_DTYPE)
+
+    # Count results: decisions by match location in one groupby over the category codes
+    # (the PASS mask is reused for the exports below)
+    passed = df['Filter1_Decision'].eq('PASS').to_numpy()
+    decision_counts = (df.groupby(['Filter1_Decision', 'Filter1_Match_Location'], observed=True).size()
+                       .unstack(fill_value=0).reindex(DECISION_DTYPE.categories, fill_value=0))
+    passed_count = int(decision_counts.loc['PASS'].sum())
+    excluded_count = int(decision_counts.loc['EXCLUDE'].sum())
 
     # ============================================
     # DISPLAY RESULTS
@@ -142,15 +146,16 @@ def filter_icd_relevance(input_csv='prisma_screening_results_all_filtered.csv',
     print("FILTER 1 RESULTS: ICD RELEVANCE")
     print("="*80)
     print(f"\nTotal papers evaluated: {len(df):,}")
-    print(f"\n  ✓ PASSED (has ICD terms):  {passed_count:,} ({passed_count/len(df)*100:.1f}%)")
-    print(f"  ✗ EXCLUDED (no ICD terms): {excluded_count:,} ({excluded_count/len(df)*100:.1f}%)")
+    print(f"\n  ✓ PASSED (has ICD terms):  {passed_count:,} ({passed_count/max(len(df), 1)*100:.1f}%)")
+    print(f"  ✗ EXCLUDED (no ICD terms): {excluded_count:,} ({excluded_count/max(len(df), 1)*100:.1f}%)")
 
     # Show where ICD terms were found (for passed papers)
     if passed_count > 0:
         print("\n" + "-"*80)
         print("ICD Terms Found In:")
         print("-"*80)
-        location_counts = df[df['Filter1_Decision'] == 'PASS']['Filter1_Match_Location'].value_counts()
+        location_counts = decision_counts.loc['PASS'].sort_values(ascending=False, kind='stable')
+        location_counts = location_counts[location_counts > 0]
         for location, count in location_counts.items():
             print(f"  {location:15s}: {count:5,} papers ({count/passed_count*100:.1f}%)")
 
@@ -169,55 +174,59 @@ def filter_icd_relevance(input_csv='prisma_screening_results_all_filtered.csv',
     print("EXPORTING RESULTS")
     print("="*80)
 
-    # 1. Save all results
+    # One selection per decision, each written twice instead of copying df per file
+    df_passed = df.loc[passed, output_columns]
+    df_excluded = df.loc[~passed, output_columns]
+
+    # 1. Save all results (PASS first)
     print(f"\n1. Saving all papers with Filter 1 decisions to {output_all}...")
-    df_output = df[output_columns].copy()
-    df_output = df_output.sort_values('Filter1_Decision', ascending=False)  # PASS first
-    df_output.to_csv(output_all, index=False, encoding='utf-8')
-    print(f"   [SUCCESS] {len(df_output):,} papers saved")
+    df_passed.to_csv(output_all, index=False, encoding='utf-8')
+    df_excluded.to_csv(output_all, mode='a', header=False, index=False, encoding='utf-8')
+    print(f"   [SUCCESS] {len(df):,} papers saved")
 
     # 2. Save passed papers
-    df_passed = df[df['Filter1_Decision'] == 'PASS'].copy()
     print(f"\n2. Saving PASSED papers to {output_pass}...")
-    df_passed[output_columns].to_csv(output_pass, index=False, encoding='utf-8')
+    df_passed.to_csv(output_pass, index=False, encoding='utf-8')
     print(f"   [SUCCESS] {len(df_passed):,} papers saved")
     print(f"   → These papers will proceed to Filter 2")
 
     # 3. Save excluded papers
-    df_excluded = df[df['Filter1_Decision'] == 'EXCLUDE'].copy()
     print(f"\n3. Saving EXCLUDED papers to {output_exclude}...")
-    df_excluded[output_columns].to_csv(output_exclude, index=False, encoding='utf-8')
+    df_excluded.to_csv(output_exclude, index=False, encoding='utf-8')
     print(f"   [SUCCESS] {len(df_excluded):,} papers saved")
     print(f"   → These papers are not relevant to ICD coding")
 
     # ============================================
-    # SAMPLE OUTPUTS
+    # SAMPLE OUTPUTS (verbose only)
     # ============================================
 
-    print("\n" + "="*80)
-    print("SAMPLE PASSED PAPERS (showing first 5)")
-    print("="*80)
-    if passed_count > 0:
-        sample_passed = df_passed.head(5)
-        for idx, row in sample_passed.iterrows():
-            title = row['Title'][:70] + '...' if len(str(row['Title'])) > 70 else row['Title']
-            print(f"\n  Title: {title}")
-            print(f"  Matched: {row['Filter1_Matched_Terms']}")
-            print(f"  Location: {row['Filter1_Match_Location']}")
-    else:
-        print("  No papers passed this filter.")
-
-    print("\n" + "="*80)
-    print("SAMPLE EXCLUDED PAPERS (showing first 3)")
-    print("="*80)
-    if excluded_count > 0:
-        sample_excluded = df_excluded.head(3)
-        for idx, row in sample_excluded.iterrows():
-            title = row['Title'][:70] + '...' if len(str(row['Title'])) > 70 else row['Title']
-            print(f"\n  Title: {title}")
-            print(f"  Reason: {row['Filter1_Reason'][:120]}...")
-    else:
-        print("  No papers were excluded.")
+    if verbose:
+        print("\n" + "="*80)
+        print("SAMPLE PASSED PAPERS (showing first 5)")
+        print("="*80)
+        if passed_count > 0:
+            sample_passed = df_passed.head(5)
+            for title, terms, location in zip(sample_passed['Title'],
+                                              sample_passed['Filter1_Matched_Terms'],
+                                              sample_passed['Filter1_Match_Location']):
+                title = title[:70] + '...' if len(str(title)) > 70 else title
+                print(f"\n  Title: {title}")
+                print(f"  Matched: {terms}")
+                print(f"  Location: {location}")
+        else:
+            print("  No papers passed this filter.")
+
+        print("\n" + "="*80)
+        print("SAMPLE EXCLUDED PAPERS (showing first 3)")
+        print("="*80)
+        if excluded_count > 0:
+            sample_excluded = df_excluded.head(3)
+            for title, reason in zip(sample_excluded['Title'], sample_excluded['Filter1_Reason']):
+                title = title[:70] + '...' if len(str(title)) > 70 else title
+                print(f"\n  Title: {title}")
+                print(f"  Reason: {reason[:120]}...")
+        else:
+            print("  No papers were excluded.")
 
     # ============================================
     # SUMMARY
@@ -247,9 +256,17 @@ if __name__ == "__main__":
     output_pass = 'filter1_passed.csv'
     output_exclude = 'filter1_excluded.csv'
 
-    # Command-line arguments
-    if len(sys.argv) > 1:
-        input_file = sys.argv[1]
+    # Command-line arguments (--verbose also prints sample papers)
+    flags = [arg for arg in sys.argv[1:] if arg.startswith('--')]
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    unknown_flags = [flag for flag in flags if flag != '--verbose']
+    if unknown_flags:
+        print(f"Unknown option(s): {' '.join(unknown_flags)}")
+        print(f"Usage: python {sys.argv[0]} [input_csv] [--verbose]")
+        sys.exit(2)
+    verbose = '--verbose' in flags
+    if args:
+        input_file = args[0]
 
     # Run Filter 1
-    filter_icd_relevance(input_file, output_all, output_pass, output_exclude)
+    filter_icd_relevance(input_file, output_all, output_pass, output_exclude, verbose=verbose)
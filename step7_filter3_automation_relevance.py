@@ -6,10 +6,25 @@ Input: filter2_passed.csv (papers that passed Filter 1: Exclusion + Filter 2: IC
 Output: FINAL dataset of papers relevant to automated ICD coding
 """
 
+import os
 import pandas as pd
-import re
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 
+from pipeline_utils import (compile_keyword_set, get_text_columns, keyword_hits, lower_pattern, parquet_path,
+                            read_papers)
+
+try:
+    import re2
+except ImportError:  # google-re2 is an optional speed-up
+    re2 = None
+
+try:
+    import pyarrow as pa
+except ImportError:  # pyarrow enables the Parquet intermediates and faster CSV parsing
+    pa = None
+
 # ============================================
 # AUTOMATION/AI/ML KEYWORDS (Mandatory)
 # ============================================
@@ -48,7 +63,7 @@ AUTOMATION_KEYWORDS = {
     'CNN': r'\bCNN\b',
     'RNN': r'\bRNN\b',
     'LSTM': r'\bLSTM\b',
-    'BiLSTM': r'\b(BiLSTM|Bi-LSTM|bidirectional LSTM)\b',
+    'BiLSTM': r'\b(?:BiLSTM|Bi-LSTM|bidirectional LSTM)\b',
     'GRU': r'\bGRU\b',
 
     # Transformers & LLMs
@@ -60,7 +75,7 @@ AUTOMATION_KEYWORDS = {
     'Attention Mechanism': r'\battention mechanism\b',
     'Self-Attention': r'\bself-attention\b',
     'Encoder-Decoder': r'\bencoder-decoder\b',
-    'Seq2Seq': r'\b(seq2seq|sequence-to-sequence)\b',
+    'Seq2Seq': r'\b(?:seq2seq|sequence-to-sequence)\b',
 
     # Learning Paradigms
     'Supervised Learning': r'\bsupervised learning\b',
@@ -100,8 +115,8 @@ AUTOMATION_KEYWORDS = {
     'Representation Learning': r'\brepresentation learning\b',
 
     # Training Techniques
-    'Fine-Tuning': r'\bfine-tun(e|ing)\b',
-    'Pre-Training': r'\bpre-train(ed|ing)\b',
+    'Fine-Tuning': r'\bfine-tun(?:e|ing)\b',
+    'Pre-Training': r'\bpre-train(?:ed|ing)\b',
     'Pre-Trained': r'\bpre-trained\b',
 
     # Knowledge-Based
@@ -110,61 +125,88 @@ AUTOMATION_KEYWORDS = {
     'Ontology': r'\bontology\b'
 }
 
+# The text is lowercased before matching, so the keyword patterns are lowercased
+# once here instead of case-folding (case=False) on every search
+AUTOMATION_REGEXES = [lower_pattern(pattern) for pattern in AUTOMATION_KEYWORDS.values()]
+
+# All keywords as one alternation: a field matches it iff any keyword matches,
+# so each field is checked with a single vectorized pass over the column
+AUTOMATION_PATTERN = '|'.join(f'(?:{pattern})' for pattern in AUTOMATION_REGEXES)
+AUTOMATION_LABELS = np.array([f'{name}; ' for name in AUTOMATION_KEYWORDS], dtype=object)
+AUTOMATION_SET = compile_keyword_set(AUTOMATION_REGEXES) if re2 is not None else None
+
+# Decisions and match locations are stored as categoricals (one byte code per row)
+DECISION_DTYPE = pd.CategoricalDtype(['PASS', 'EXCLUDE'])
+LOCATION_DTYPE = pd.CategoricalDtype(['Title', 'Abstract', 'Keywords', 'N/A'])
+
 # ============================================
 # HELPER FUNCTIONS
 # ============================================
 
-def get_text_from_row(row):
-    """Extract and combine Title, Abstract, and Keywords"""
-    title = str(row.get('Title', '')).lower() if pd.notna(row.get('Title')) else ''
-    abstract = str(row.get('Abstract', '')).lower() if pd.notna(row.get('Abstract')) else ''
-    keywords = str(row.get('Keywords', '')).lower() if pd.notna(row.get('Keywords')) else ''
-
-    return title, abstract, keywords
-
 def find_automation_keywords(text):
-    """Find all automation/AI keywords that match in the text"""
-    matches = []
-    for keyword_name, pattern in AUTOMATION_KEYWORDS.items():
-        if re.search(pattern, text, re.IGNORECASE):
-            matches.append(keyword_name)
-    return matches
-
-def check_automation_relevance(row):
+    """Find all automation/AI keywords that match in each row of a text column ('; '-joined)"""
+    if AUTOMATION_SET is not None:
+        # One linear-time scan per text reports the id of every matching keyword
+        names = list(AUTOMATION_KEYWORDS)
+        return pd.Series(['; '.join(names[i] for i in sorted(AUTOMATION_SET.Match(t) or ())) for t in text],
+                         index=text.index, dtype=object)
+
+    hits = np.column_stack([keyword_hits(text, pattern) for pattern in AUTOMATION_REGEXES])
+    # Row-wise join of the matched names: bool matrix @ 'name; ' labels
+    return pd.Series([terms[:-2] for terms in hits.astype(object) @ AUTOMATION_LABELS],
+                     index=text.index, dtype=object)
+
+def check_automation_relevance(df):
+    """
+    Check if each paper is about automation/AI/ML methods
+    Returns: (decision, matched_terms, location, reason) Series
+    """
+    return check_automation_text(*get_text_columns(df))
+
+def check_automation_text(title, abstract, keywords):
     """
-    Check if paper is about automation/AI/ML methods
-    Returns: (decision, matched_terms, location, reason)
+    check_automation_relevance on already lowercased Title, Abstract and Keywords columns
+    Returns: (decision, matched_terms, location, reason) Series
     """
-    title, abstract, keywords = get_text_from_row(row)
-
-    # Check if all fields are empty
-    if not title and not abstract and not keywords:
-        return 'EXCLUDE', '', 'N/A', 'No title, abstract, or keywords available for evaluation'
-
-    # Check Title first
-    title_matches = find_automation_keywords(title)
-    if title_matches:
-        matched_terms_str = '; '.join(title_matches)
-        reason = f"Paper mentions automation/AI terms in TITLE: {matched_terms_str}. Relevant to automated ICD coding."
-        return 'PASS', matched_terms_str, 'Title', reason
-
-    # Check Abstract
-    abstract_matches = find_automation_keywords(abstract)
-    if abstract_matches:
-        matched_terms_str = '; '.join(abstract_matches)
-        reason = f"Paper mentions automation/AI terms in ABSTRACT: {matched_terms_str}. Relevant to automated ICD coding."
-        return 'PASS', matched_terms_str, 'Abstract', reason
-
-    # Check Keywords
-    keyword_matches = find_automation_keywords(keywords)
-    if keyword_matches:
-        matched_terms_str = '; '.join(keyword_matches)
-        reason = f"Paper mentions automation/AI terms in KEYWORDS: {matched_terms_str}. Relevant to automated ICD coding."
-        return 'PASS', matched_terms_str, 'Keywords', reason
+    # Check Title first, then Abstract, then Keywords
+    in_title = title.str.contains(AUTOMATION_PATTERN)
+    in_abstract = abstract.str.contains(AUTOMATION_PATTERN)
+    in_keywords = keywords.str.contains(AUTOMATION_PATTERN)
+    location = pd.Series(np.select([in_title, in_abstract, in_keywords],
+                                   ['Title', 'Abstract', 'Keywords'], default='N/A'),
+                         index=title.index, dtype=LOCATION_DTYPE)
+    passed = location != 'N/A'
+    decision = pd.Series(np.where(passed, 'PASS', 'EXCLUDE'), index=title.index, dtype=DECISION_DTYPE)
+
+    # Matched terms are only collected from the field that decided the match
+    matched_terms = pd.Series('', index=title.index, dtype=object)
+    for field, text in (('Title', title), ('Abstract', abstract), ('Keywords', keywords)):
+        in_field = location == field
+        matched_terms[in_field] = find_automation_keywords(text[in_field])
 
     # No automation/AI terms found anywhere
-    reason = "Paper does not mention automation, AI, machine learning, or computational methods. Likely about manual ICD coding, coding guidelines, or general ICD topics without automation."
-    return 'EXCLUDE', '', 'N/A', reason
+    reason = pd.Series("Paper does not mention automation, AI, machine learning, or computational methods. Likely about manual ICD coding, coding guidelines, or general ICD topics without automation.",
+                       index=title.index, dtype=object)
+    reason[(title == '') & (abstract == '') & (keywords == '')] = 'No title, abstract, or keywords available for evaluation'
+    reason[passed] = ('Paper mentions automation/AI terms in ' + location[passed].str.upper() + ': '
+                      + matched_terms[passed] + '. Relevant to automated ICD coding.')
+
+    return decision, matched_terms, location, reason
+
+def apply_automation_filter(df, n_jobs=None):
+    """
+    Run check_automation_relevance over n_jobs row blocks in parallel
+    Returns: (decision, matched_terms, location, reason) Series
+    """
+    n_jobs = n_jobs or os.cpu_count() or 1
+    text_df = df[[col for col in ('Title', 'Abstract', 'Keywords') if col in df.columns]]
+    if n_jobs == 1 or len(df) < 2 * n_jobs:
+        return check_automation_relevance(text_df)
+
+    blocks = [text_df.iloc[idx] for idx in np.array_split(np.arange(len(df)), n_jobs)]
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        results = list(executor.map(check_automation_relevance, blocks))
+    return tuple(pd.concat(parts) for parts in zip(*results))
 
 # ============================================
 # MAIN FILTERING FUNCTION
@@ -173,7 +215,8 @@ def check_automation_relevance(row):
 def filter_automation_relevance(input_csv='filter2_passed.csv',
                                 output_all='filter3_all_results.csv',
                                 output_pass='filter3_passed.csv',
-                                output_exclude='filter3_excluded.csv'):
+                                output_exclude='filter3_excluded.csv',
+                                n_jobs=None, verbose=False, decisions_only=False):
     """
     Filter 3: Check for Automation/AI relevance
 
@@ -182,6 +225,9 @@ def filter_automation_relevance(input_csv='filter2_passed.csv',
     - output_all: Complete results with all papers
     - output_pass: Papers that PASSED (have automation/AI terms)
     - output_exclude: Papers that were EXCLUDED (no automation/AI terms)
+    - n_jobs: Worker processes for the keyword checks (default: all CPU cores)
+    - verbose: Print sample passed/excluded papers (default: off)
+    - decisions_only: Write only the row key (Row, DOI) and the Filter3 columns to output_all
     """
 
     print("="*80)
@@ -193,7 +239,7 @@ def filter_automation_relevance(input_csv='filter2_passed.csv',
 
     # Load data
     print(f"\nLoading data from {input_csv}...")
-    df = pd.read_csv(input_csv, low_memory=False)
+    df = read_papers(input_csv)
     print(f"Total records loaded: {len(df):,}")
     print("(Papers that passed Filter 1: Exclusion + Filter 2: ICD Relevance)")
 
@@ -206,15 +252,16 @@ def filter_automation_relevance(input_csv='filter2_passed.csv',
     print("-"*80)
 
     # Apply the filter
-    results = df.apply(check_automation_relevance, axis=1)
-    df['Filter3_Decision'] = results.apply(lambda x: x[0])
-    df['Filter3_Matched_Terms'] = results.apply(lambda x: x[1])
-    df['Filter3_Match_Location'] = results.apply(lambda x: x[2])
-    df['Filter3_Reason'] = results.apply(lambda x: x[3])
+    (df['Filter3_Decision'], df['Filter3_Matched_Terms'],
+     df['Filter3_Match_Location'], df['Filter3_Reason']) = apply_automation_filter(df, n_jobs)
 
-    # Count results
-    passed_count = (df['Filter3_Decision'] == 'PASS').sum()
-    excluded_count = (df['Filter3_Decision'] == 'EXCLUDE').sum()
+    # Count results: decisions by match location in one groupby over the category codes
+    # (the PASS mask is reused for the exports below)
+    passed = df['Filter3_Decision'].eq('PASS').to_numpy()
+    decision_counts = (df.groupby(['Filter3_Decision', 'Filter3_Match_Location'], observed=True).size()
+                       .unstack(fill_value=0).reindex(DECISION_DTYPE.categories, fill_value=0))
+    passed_count = int(decision_counts.loc['PASS'].sum())
+    excluded_count = int(decision_counts.loc['EXCLUDE'].sum())
 
     # ============================================
     # DISPLAY RESULTS
@@ -224,15 +271,16 @@ def filter_automation_relevance(input_csv='filter2_passed.csv',
     print("FILTER 2 RESULTS: AUTOMATION/AI RELEVANCE")
     print("="*80)
     print(f"\nTotal papers evaluated: {len(df):,}")
-    print(f"\n  [PASS] PASSED (has automation/AI terms):  {passed_count:,} ({passed_count/len(df)*100:.1f}%)")
-    print(f"  [EXCLUDE] EXCLUDED (no automation/AI terms): {excluded_count:,} ({excluded_count/len(df)*100:.1f}%)")
+    print(f"\n  [PASS] PASSED (has automation/AI terms):  {passed_count:,} ({passed_count/max(len(df), 1)*100:.1f}%)")
+    print(f"  [EXCLUDE] EXCLUDED (no automation/AI terms): {excluded_count:,} ({excluded_count/max(len(df), 1)*100:.1f}%)")
 
     # Show where automation/AI terms were found (for passed papers)
     if passed_count > 0:
         print("\n" + "-"*80)
         print("Automation/AI Terms Found In:")
         print("-"*80)
-        location_counts = df[df['Filter3_Decision'] == 'PASS']['Filter3_Match_Location'].value_counts()
+        location_counts = decision_counts.loc['PASS'].sort_values(ascending=False, kind='stable')
+        location_counts = location_counts[location_counts > 0]
         for location, count in location_counts.items():
             print(f"  {location:15s}: {count:5,} papers ({count/passed_count*100:.1f}%)")
 
@@ -252,55 +300,68 @@ def filter_automation_relevance(input_csv='filter2_passed.csv',
     print("EXPORTING RESULTS")
     print("="*80)
 
-    # 1. Save all results
+    # One selection per decision, each written twice instead of copying df per file
+    df_passed = df.loc[passed, output_columns]
+    df_excluded = df.loc[~passed, output_columns]
+
+    # 1. Save all results (PASS first), or only the decisions keyed by input row
+    #    (Row) and DOI, so the paper columns are not written a second time
     print(f"\n1. Saving all papers with Filter 2 decisions to {output_all}...")
-    df_output = df[output_columns].copy()
-    df_output = df_output.sort_values('Filter3_Decision', ascending=False)  # PASS first
-    df_output.to_csv(output_all, index=False, encoding='utf-8')
-    print(f"   [SUCCESS] {len(df_output):,} papers saved")
+    if decisions_only:
+        key_columns = [col for col in ['DOI'] if col in df.columns]
+        filter_columns = [col for col in output_columns if col.startswith('Filter3_')]
+        df[key_columns + filter_columns].to_csv(output_all, index_label='Row', encoding='utf-8')
+    else:
+        df_passed.to_csv(output_all, index=False, encoding='utf-8')
+        df_excluded.to_csv(output_all, mode='a', header=False, index=False, encoding='utf-8')
+    print(f"   [SUCCESS] {len(df):,} papers saved")
 
     # 2. Save passed papers
-    df_passed = df[df['Filter3_Decision'] == 'PASS'].copy()
     print(f"\n2. Saving PASSED papers to {output_pass}...")
-    df_passed[output_columns].to_csv(output_pass, index=False, encoding='utf-8')
+    df_passed.to_csv(output_pass, index=False, encoding='utf-8')
+    if pa is not None:
+        # Filter 4 reads this Parquet copy instead of re-parsing the CSV
+        df_passed.to_parquet(parquet_path(output_pass), compression='snappy', index=False)
     print(f"   [SUCCESS] {len(df_passed):,} papers saved")
     print(f"   *** THIS IS THE FINAL DATASET FOR LITERATURE REVIEW ***")
 
     # 3. Save excluded papers
-    df_excluded = df[df['Filter3_Decision'] == 'EXCLUDE'].copy()
     print(f"\n3. Saving EXCLUDED papers to {output_exclude}...")
-    df_excluded[output_columns].to_csv(output_exclude, index=False, encoding='utf-8')
+    df_excluded.to_csv(output_exclude, index=False, encoding='utf-8')
     print(f"   [SUCCESS] {len(df_excluded):,} papers saved")
     print(f"   -> These papers are about ICD coding but not automated")
 
     # ============================================
-    # SAMPLE OUTPUTS
+    # SAMPLE OUTPUTS (verbose only)
     # ============================================
 
-    print("\n" + "="*80)
-    print("SAMPLE PASSED PAPERS (showing first 5)")
-    print("="*80)
-    if passed_count > 0:
-        sample_passed = df_passed.head(5)
-        for idx, row in sample_passed.iterrows():
-            title = row['Title'][:70] + '...' if len(str(row['Title'])) > 70 else row['Title']
-            print(f"\n  Title: {title}")
-            print(f"  Matched: {row['Filter3_Matched_Terms'][:100]}")
-            print(f"  Location: {row['Filter3_Match_Location']}")
-    else:
-        print("  No papers passed this filter.")
-
-    print("\n" + "="*80)
-    print("SAMPLE EXCLUDED PAPERS (showing first 3)")
-    print("="*80)
-    if excluded_count > 0:
-        sample_excluded = df_excluded.head(3)
-        for idx, row in sample_excluded.iterrows():
-            title = row['Title'][:70] + '...' if len(str(row['Title'])) > 70 else row['Title']
-            print(f"\n  Title: {title}")
-            print(f"  Reason: {row['Filter3_Reason'][:120]}...")
-    else:
-        print("  No papers were excluded.")
+    if verbose:
+        print("\n" + "="*80)
+        print("SAMPLE PASSED PAPERS (showing first 5)")
+        print("="*80)
+        if passed_count > 0:
+            sample_passed = df_passed.head(5)
+            for title, terms, location in zip(sample_passed['Title'],
+                                              sample_passed['Filter3_Matched_Terms'],
+                                              sample_passed['Filter3_Match_Location']):
+                title = title[:70] + '...' if len(str(title)) > 70 else title
+                print(f"\n  Title: {title}")
+                print(f"  Matched: {terms[:100]}")
+                print(f"  Location: {location}")
+        else:
+            print("  No papers passed this filter.")
+
+        print("\n" + "="*80)
+        print("SAMPLE EXCLUDED PAPERS (showing first 3)")
+        print("="*80)
+        if excluded_count > 0:
+            sample_excluded = df_excluded.head(3)
+            for title, reason in zip(sample_excluded['Title'], sample_excluded['Filter3_Reason']):
+                title = title[:70] + '...' if len(str(title)) > 70 else title
+                print(f"\n  Title: {title}")
+                print(f"  Reason: {reason[:120]}...")
+        else:
+            print("  No papers were excluded.")
 
     # ============================================
     # SUMMARY
@@ -330,9 +391,15 @@ if __name__ == "__main__":
     output_pass = 'filter3_passed.csv'
     output_exclude = 'filter3_excluded.csv'
 
-    # Command-line arguments
-    if len(sys.argv) > 1:
-        input_file = sys.argv[1]
+    # Command-line arguments (--verbose also prints sample papers,
+    # --decisions-only writes only the row key and decisions to the all-results file)
+    flags = [arg for arg in sys.argv[1:] if arg.startswith('--')]
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    verbose = '--verbose' in flags
+    decisions_only = '--decisions-only' in flags
+    if args:
+        input_file = args[0]
 
     # Run Filter 2
-    filter_automation_relevance(input_file, output_all, output_pass, output_exclude)
+    filter_automation_relevance(input_file, output_all, output_pass, output_exclude,
+                                verbose=verbose, decisions_only=decisions_only)
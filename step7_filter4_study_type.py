@@ -6,10 +6,26 @@ Input: filter3_passed.csv (papers that passed Filters 1-3: automated ICD coding
 Output: Categorized papers by study type
 """
 
+import os
+import contextlib
 import pandas as pd
+import numpy as np
 import re
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 
+from pipeline_utils import append_csv, compile_keyword_set, get_text_columns, lower_pattern, read_papers
+
+try:
+    import re2
+except ImportError:  # google-re2 is an optional speed-up
+    re2 = None
+
+try:
+    import pyarrow as pa
+except ImportError:  # pyarrow enables the Parquet intermediates and faster CSV parsing/writing
+    pa = None
+
 # ============================================
 # STUDY TYPE KEYWORDS
 # ============================================
@@ -25,14 +41,14 @@ SECONDARY_STUDY_KEYWORDS = {
     'Umbrella Review': r'\bumbrella review\b',
 
     # Surveys & Overviews (more specific context)
-    'Survey': r'\b(survey of|survey on|survey:|^survey)\b',  # Avoid "survey study" (primary research)
-    'State-of-the-Art Review': r'\b(state-of-the-art (survey|review|overview)|survey of (the )?state-of-the-art)\b',
-    'Overview': r'\b(overview of|overview on|overview:)\b',
+    'Survey': r'\b(?:survey of|survey on|survey:|^survey)\b',  # Avoid "survey study" (primary research)
+    'State-of-the-Art Review': r'\b(?:state-of-the-art (?:survey|review|overview)|survey of (?:the )?state-of-the-art)\b',
+    'Overview': r'\b(?:overview of|overview on|overview:)\b',
 
     # Review phrases (must be in title or start of abstract)
-    'Review Article': r'\b(review of|review on|a review of) (automated|automatic|machine learning|deep learning|AI|methods|approaches|techniques|algorithms)\b',
-    'Comprehensive Review': r'\bcomprehensive (review|survey|overview)\b',
-    'Recent Advances': r'\brecent advances in (automated|automatic|machine learning|deep learning|AI)\b',
+    'Review Article': r'\b(?:review of|review on) (?:automated|automatic|machine learning|deep learning|AI|methods|approaches|techniques|algorithms)\b',
+    'Comprehensive Review': r'\bcomprehensive (?:review|survey|overview)\b',
+    'Recent Advances': r'\brecent advances in (?:automated|automatic|machine learning|deep learning|AI)\b',
 }
 
 # Non-Research Items - Exclude entirely
@@ -40,109 +56,220 @@ SECONDARY_STUDY_KEYWORDS = {
 # Only match when clearly indicating paper TYPE, not just using words in passing
 NON_RESEARCH_KEYWORDS = {
     # Editorials & Opinions (must be in title or as paper type descriptor)
-    'Editorial': r'\b(editorial|^editorial)\b',
-    'Commentary': r'\b(commentary|^commentary)\b',
-    'Opinion Piece': r'\b(opinion piece|opinion article)\b',
-    'Viewpoint': r'\b(viewpoint|^viewpoint)\b',
+    'Editorial': r'\beditorial\b',
+    'Commentary': r'\bcommentary\b',
+    'Opinion Piece': r'\b(?:opinion piece|opinion article)\b',
+    'Viewpoint': r'\bviewpoint\b',
 
     # Correspondence (very specific patterns - must be clear paper type indicator)
-    'Letter to Editor': r'\b(letter to( the)? editor|correspondence( to( the)?)? editor)\b',
-    'Author Reply': r'\b(author.?s? (response|reply)|reply to (comment|letter)|response to (comment|letter))\b',
+    'Letter to Editor': r'\b(?:letter to(?: the)? editor|correspondence(?: to(?: the)?)? editor)\b',
+    'Author Reply': r'\b(?:author.?s? (?:response|reply)|reply to (?:comment|letter)|response to (?:comment|letter))\b',
 
     # Other Non-Research (clear non-research indicators)
-    'News Item': r'\bnews( item| article)\b',
-    'Erratum': r'\b(erratum|errata)\b',
+    'News Item': r'\bnews(?: item| article)\b',
+    'Erratum': r'\b(?:erratum|errata)\b',
     'Retraction': r'\bretraction\b',
     'Corrigendum': r'\bcorrigendum\b',
-    'Preface': r'\bpreface( to)?\b',
+    'Preface': r'\bpreface\b',
     'Book Review': r'\bbook review\b',
-    'Meeting Report': r'\b(conference summary|workshop summary|meeting report)\b',
+    'Meeting Report': r'\b(?:conference summary|workshop summary|meeting report)\b',
 }
 
+# Publication types that mark a non-research item
+NON_RESEARCH_TYPES = ['editorial', 'letter', 'note', 'erratum', 'retraction', 'commentary']
+
+# The text is lowercased before matching, so the keyword patterns are lowercased
+# once here instead of using IGNORECASE on every search
+SECONDARY_REGEXES = [lower_pattern(pattern) for pattern in SECONDARY_STUDY_KEYWORDS.values()]
+NON_RESEARCH_REGEXES = [lower_pattern(pattern) for pattern in NON_RESEARCH_KEYWORDS.values()]
+
+# Each keyword set as one alternation: a text matches it iff any of its keywords
+# matches, so texts without any keyword (most of them) cost a single search
+SECONDARY_PATTERN = '|'.join(f'(?:{pattern})' for pattern in SECONDARY_REGEXES)
+NON_RESEARCH_PATTERN = '|'.join(f'(?:{pattern})' for pattern in NON_RESEARCH_REGEXES)
+SECONDARY_LABELS = np.array([f'{name}; ' for name in SECONDARY_STUDY_KEYWORDS], dtype=object)
+NON_RESEARCH_LABELS = np.array([f'{name}; ' for name in NON_RESEARCH_KEYWORDS], dtype=object)
+
+# Columns of the strong single indicators in the secondary keyword hit matrix
+SYSTEMATIC_REVIEW_COLUMN = list(SECONDARY_STUDY_KEYWORDS).index('Systematic Review')
+META_ANALYSIS_COLUMN = list(SECONDARY_STUDY_KEYWORDS).index('Meta-Analysis')
+
+# Without pyarrow, str.contains runs Python's re once per keyword; an RE2 set reports
+# every keyword matching a text in one linear-time scan instead. (With pyarrow,
+# str.contains already runs RE2 over the whole column, which is faster than the set)
+SECONDARY_SET = compile_keyword_set(SECONDARY_REGEXES) if re2 is not None and pa is None else None
+NON_RESEARCH_SET = compile_keyword_set(NON_RESEARCH_REGEXES) if re2 is not None and pa is None else None
+
+# Decisions and categories are stored as categoricals (one byte code per row)
+DECISION_DTYPE = pd.CategoricalDtype(['PRIMARY', 'SECONDARY', 'EXCLUDE'])
+CATEGORY_DTYPE = pd.CategoricalDtype(['Original Research', 'Review/Survey', 'Non-Research', 'Insufficient Data'])
+
+# Rows per CSV write: rows are only copied out of the table in slices of this size when written
+CHUNK_SIZE = 50_000
+
+# ============================================
+# OUTPUT COLUMNS
+# ============================================
+
+PREVIOUS_FILTER_COLUMNS = [
+    'Filter1_Decision', 'Filter1_Matched_Terms', 'Filter1_Match_Location',
+    'Filter2_Decision', 'Filter2_Matched_Terms', 'Filter2_Match_Location',
+    'Filter3_Decision', 'Filter3_Matched_Terms', 'Filter3_Match_Location',
+]
+FILTER4_COLUMNS = ['Filter4_Decision', 'Filter4_Category', 'Filter4_Matched_Terms', 'Filter4_Reason']
+PAPER_COLUMNS = ['Title', 'Authors', 'Year', 'Publication', 'Type', 'DOI', 'Abstract', 'Keywords', 'URL']
+
+# Only these input columns are loaded: the ones classified on or copied to the outputs
+INPUT_COLUMNS = PREVIOUS_FILTER_COLUMNS + PAPER_COLUMNS
+
 # ============================================
 # HELPER FUNCTIONS
 # ============================================
 
-def get_text_from_row(row):
-    """Extract and combine Title, Abstract, and Keywords"""
-    title = str(row.get('Title', '')).lower() if pd.notna(row.get('Title')) else ''
-    abstract = str(row.get('Abstract', '')).lower() if pd.notna(row.get('Abstract')) else ''
-    keywords = str(row.get('Keywords', '')).lower() if pd.notna(row.get('Keywords')) else ''
-    pub_type = str(row.get('Type', '')).lower() if pd.notna(row.get('Type')) else ''
+def contains_bytes(texts, pattern):
+    """Boolean array: which latin-1 encoded texts (bytes) the pattern matches, searched as bytes"""
+    search = re.compile(pattern.encode()).search
+    return np.fromiter((search(text) is not None for text in texts), dtype=bool, count=len(texts))
 
-    return title, abstract, keywords, pub_type
+def keyword_hit_matrix(text, regexes, any_pattern, keyword_set=None):
+    """
+    Boolean matrix (rows x keywords): which rows of a lowercased text column match each keyword
+    Each distinct text is searched once (empty fields and papers listed by several
+    sources repeat). any_pattern (the alternation of all keywords) is checked first,
+    so the keywords are only searched (one by one, or with keyword_set) on the texts it matches
+    """
+    codes, unique_text = pd.factorize(text)
+    unique_text = pd.Series(unique_text)
+    if pa is None:
+        # Python's re searches the texts one by one, faster as latin-1 bytes (one byte per
+        # character, '?' for the rest); \b then uses ASCII word characters, as RE2 does with pyarrow
+        encoded = np.array([t.encode('latin-1', errors='replace') for t in unique_text], dtype=object)
+        candidates = contains_bytes(encoded, any_pattern)
+    else:
+        candidates = unique_text.str.contains(any_pattern).to_numpy(dtype=bool)
+
+    hits = np.zeros((len(unique_text), len(regexes)), dtype=bool)
+    if keyword_set is not None:
+        for i, candidate in zip(np.flatnonzero(candidates), unique_text[candidates]):
+            hits[i, keyword_set.Match(candidate) or []] = True
+    elif pa is None:
+        for k, pattern in enumerate(regexes):
+            hits[candidates, k] = contains_bytes(encoded[candidates], pattern)
+    else:
+        for k, pattern in enumerate(regexes):
+            hits[candidates, k] = unique_text[candidates].str.contains(pattern).to_numpy(dtype=bool)
+    return hits[codes]
 
-def find_matching_keywords(text, keyword_dict):
-    """Find all keywords that match in the text"""
-    matches = []
-    for keyword_name, pattern in keyword_dict.items():
-        if re.search(pattern, text, re.IGNORECASE):
-            matches.append(keyword_name)
-    return matches
+def join_terms(hits, labels, extra_terms=''):
+    """
+    '; '-joined names of the matching keywords in each row, followed by its extra term (if any)
+    Row-wise join of the matched names: bool matrix @ 'name; ' labels
+    """
+    terms = hits.astype(object) @ labels + extra_terms
+    return pd.Series(terms, dtype=object).str[:-2].to_numpy()
 
-def classify_study_type(row):
+def classify_study_type(df):
     """
-    Classify paper as PRIMARY, SECONDARY, or EXCLUDE
-    Returns: (decision, category, matched_terms, reason)
+    Classify each paper as PRIMARY, SECONDARY, or EXCLUDE
+    Returns: (decision, category, matched_terms, reason) Series
     """
-    title, abstract, keywords, pub_type = get_text_from_row(row)
+    title, abstract, pub_type = get_text_columns(df, ('Title', 'Abstract', 'Type'))
 
-    # Check if all fields are empty
-    if not title and not abstract:
-        return 'EXCLUDE', 'Insufficient Data', '', 'No title or abstract available for evaluation'
+    # Publication types take only a handful of values: the type masks and terms below are
+    # computed once per distinct type (as categorical codes) and then taken for every row
+    type_codes, type_values = pd.factorize(pub_type)
+    type_values = pd.Series(type_values)
+    type_terms = ('Publication Type: ' + type_values.astype(object) + '; ').to_numpy()[type_codes]
 
-    # Keep title and abstract separate for context-specific matching
-    # combined_text = f"{title} {title} {abstract}"  # Title counted twice for emphasis
+    # Papers without title and abstract cannot be evaluated
+    no_text = ((title == '') & (abstract == '')).to_numpy(dtype=bool)
 
     # ============================================
     # STEP 1: Check for NON-RESEARCH items (EXCLUDE)
     # ============================================
     # ONLY check title for non-research keywords (most reliable indicator)
     # If these terms are just in the abstract, they're likely false positives
-    non_research_matches = find_matching_keywords(title, NON_RESEARCH_KEYWORDS)
+    non_research_hits = keyword_hit_matrix(title, NON_RESEARCH_REGEXES, NON_RESEARCH_PATTERN, NON_RESEARCH_SET)
 
     # Also check publication type field
-    if pub_type in ['editorial', 'letter', 'note', 'erratum', 'retraction', 'commentary']:
-        non_research_matches.append(f'Publication Type: {pub_type}')
-
-    if non_research_matches:
-        matched_terms_str = '; '.join(non_research_matches)
-        reason = f"Non-research item: {matched_terms_str}. Editorials, commentaries, letters, and news items are not original research."
-        return 'EXCLUDE', 'Non-Research', matched_terms_str, reason
+    non_research_type = type_values.isin(NON_RESEARCH_TYPES).to_numpy(dtype=bool)[type_codes]
+    non_research = non_research_hits.any(axis=1) | non_research_type
 
     # ============================================
     # STEP 2: Check for SECONDARY STUDIES (FLAG)
     # ============================================
     # Check title FIRST - review papers typically have "review" or "survey" in title
-    secondary_matches = find_matching_keywords(title, SECONDARY_STUDY_KEYWORDS)
-
-    # If strong indicators in title, classify as secondary
-    if secondary_matches:
-        matched_terms_str = '; '.join(secondary_matches)
-        reason = f"Secondary study (in title): {matched_terms_str}. Systematic reviews and surveys are valuable for background but are not primary research."
-        return 'SECONDARY', 'Review/Survey', matched_terms_str, reason
+    title_secondary_hits = keyword_hit_matrix(title, SECONDARY_REGEXES, SECONDARY_PATTERN, SECONDARY_SET)
+    secondary_in_title = title_secondary_hits.any(axis=1)
 
     # Check abstract for review indicators (but be more cautious)
     # Only flag as secondary if multiple indicators or very strong single indicator
-    abstract_secondary_matches = find_matching_keywords(abstract, SECONDARY_STUDY_KEYWORDS)
+    abstract_secondary_hits = keyword_hit_matrix(abstract, SECONDARY_REGEXES, SECONDARY_PATTERN, SECONDARY_SET)
 
-    # Check publication type for review indicators
-    if 'review' in pub_type and 'peer' not in pub_type:  # "peer review" is not a review paper
-        abstract_secondary_matches.append(f'Publication Type: {pub_type}')
+    # Check publication type for review indicators ("peer review" is not a review paper)
+    review_type = (type_values.str.contains('review', regex=False)
+                   & ~type_values.str.contains('peer', regex=False)).to_numpy(dtype=bool)[type_codes]
 
     # Only classify as secondary if we have strong evidence from abstract
-    if len(abstract_secondary_matches) >= 2 or 'Systematic Review' in abstract_secondary_matches or 'Meta-Analysis' in abstract_secondary_matches:
-        matched_terms_str = '; '.join(abstract_secondary_matches)
-        reason = f"Secondary study: {matched_terms_str}. Systematic reviews and surveys are valuable for background but are not primary research."
-        return 'SECONDARY', 'Review/Survey', matched_terms_str, reason
+    # (row sums and columns of the hit matrix, for all rows at once)
+    secondary_in_abstract = ((np.count_nonzero(abstract_secondary_hits, axis=1) + review_type >= 2)
+                             | abstract_secondary_hits[:, SYSTEMATIC_REVIEW_COLUMN]
+                             | abstract_secondary_hits[:, META_ANALYSIS_COLUMN])
 
     # ============================================
     # STEP 3: Default to PRIMARY RESEARCH (INCLUDE)
     # ============================================
+    # The first step that applies decides; if none does, it's primary research
+    steps = [no_text, non_research, secondary_in_title, secondary_in_abstract]
+    decision = pd.Series(np.select(steps, ['EXCLUDE', 'EXCLUDE', 'SECONDARY', 'SECONDARY'], default='PRIMARY'),
+                         index=df.index, dtype=DECISION_DTYPE)
+    category = pd.Series(np.select(steps, ['Insufficient Data', 'Non-Research', 'Review/Survey', 'Review/Survey'],
+                                   default='Original Research'),
+                         index=df.index, dtype=CATEGORY_DTYPE)
+    matched_terms = pd.Series(np.select(steps, ['',
+                                                join_terms(non_research_hits, NON_RESEARCH_LABELS,
+                                                           np.where(non_research_type, type_terms, '')),
+                                                join_terms(title_secondary_hits, SECONDARY_LABELS),
+                                                join_terms(abstract_secondary_hits, SECONDARY_LABELS,
+                                                           np.where(review_type, type_terms, ''))],
+                                        default=''),
+                              index=df.index, dtype=object)
+    reason = pd.Series(np.select(steps, ['No title or abstract available for evaluation',
+                                         "Non-research item: " + matched_terms + ". Editorials, commentaries, letters, and news items are not original research.",
+                                         "Secondary study (in title): " + matched_terms + ". Systematic reviews and surveys are valuable for background but are not primary research.",
+                                         "Secondary study: " + matched_terms + ". Systematic reviews and surveys are valuable for background but are not primary research."],
+                                 default="Primary research: Original contribution (no review/survey/editorial indicators detected)."),
+                       index=df.index, dtype=object)
+
+    return decision, category, matched_terms, reason
+
+def apply_study_type(df, n_jobs=None):
+    """
+    Run classify_study_type over n_jobs row blocks in parallel
+    Returns: (decision, category, matched_terms, reason) Series
+    """
+    n_jobs = n_jobs or os.cpu_count() or 1
+    text_df = df[[col for col in ('Title', 'Abstract', 'Type') if col in df.columns]]
+    if n_jobs == 1 or len(df) < 2 * n_jobs:
+        return classify_study_type(text_df)
+
+    blocks = [text_df.iloc[idx] for idx in np.array_split(np.arange(len(df)), n_jobs)]
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        results = list(executor.map(classify_study_type, blocks))
+    return tuple(pd.concat(parts) for parts in zip(*results))
 
-    # If not a review or non-research item, it's primary research
-    reason = "Primary research: Original contribution (no review/survey/editorial indicators detected)."
-    return 'PRIMARY', 'Original Research', '', reason
+def compact_year(year):
+    """
+    Year column as Int16 (e.g. '2019.0' is written as 2019), or unchanged
+    if any value is not a whole number (e.g. 'n.d.')
+    """
+    numeric = pd.to_numeric(year, errors='coerce')
+    if numeric.isna().sum() > year.isna().sum():
+        return year
+    try:
+        return numeric.astype(pd.Int16Dtype())
+    except (TypeError, ValueError):  # fractional or out of range
+        return year
 
 # ============================================
 # MAIN FILTERING FUNCTION
@@ -152,16 +279,21 @@ def filter_study_type(input_csv='filter3_passed.csv',
                       output_all='filter4_all_results.csv',
                       output_primary='filter4_primary_research.csv',
                       output_secondary='filter4_secondary_studies.csv',
-                      output_exclude='filter4_excluded.csv'):
+                      output_exclude='filter4_excluded.csv',
+                      n_jobs=None, verbose=False, minimal_columns=False):
     """
     Filter 4: Classify papers by study type
 
     Parameters:
     - input_csv: Input CSV file (papers that passed Filters 1-3)
     - output_all: Complete results with all papers and classifications
+                  (None: not written, it holds the same rows as the three files below)
     - output_primary: PRIMARY research papers (main dataset for literature review)
     - output_secondary: SECONDARY studies (reviews/surveys - flagged for separate analysis)
     - output_exclude: EXCLUDED non-research items (editorials, letters, etc.)
+    - n_jobs: Worker processes for the classification (default: all CPU cores)
+    - verbose: Print the category breakdowns and sample papers (default: off)
+    - minimal_columns: Leave the Filter 1-3 decision columns out of the outputs (default: off)
     """
 
     print("="*80)
@@ -174,7 +306,7 @@ def filter_study_type(input_csv='filter3_passed.csv',
 
     # Load data
     print(f"\nLoading data from {input_csv}...")
-    df = pd.read_csv(input_csv, low_memory=False)
+    df = read_papers(input_csv, PAPER_COLUMNS if minimal_columns else INPUT_COLUMNS)
     print(f"Total records loaded: {len(df):,}")
     print("(Papers that passed Filters 1-3: Automated ICD coding papers)")
 
@@ -187,16 +319,25 @@ def filter_study_type(input_csv='filter3_passed.csv',
     print("-"*80)
 
     # Apply the filter
-    results = df.apply(classify_study_type, axis=1)
-    df['Filter4_Decision'] = results.apply(lambda x: x[0])
-    df['Filter4_Category'] = results.apply(lambda x: x[1])
-    df['Filter4_Matched_Terms'] = results.apply(lambda x: x[2])
-    df['Filter4_Reason'] = results.apply(lambda x: x[3])
+    (df['Filter4_Decision'], df['Filter4_Category'],
+     df['Filter4_Matched_Terms'], df['Filter4_Reason']) = apply_study_type(df, n_jobs)
+
+    # Select columns for output
+    output_columns = ([] if minimal_columns else PREVIOUS_FILTER_COLUMNS) + FILTER4_COLUMNS + PAPER_COLUMNS
+    output_columns = [col for col in output_columns if col in df.columns]
+    if 'Year' in df.columns:
+        df['Year'] = compact_year(df['Year'])
+
+    # Row positions of each decision from one groupby pass (reused for the counts,
+    # breakdowns, exports and samples below, without copying the rows into groups)
+    positions = df.groupby('Filter4_Decision', observed=True).indices
+    primary, secondary, excluded = (positions.get(decision, np.array([], dtype=np.intp))
+                                    for decision in ('PRIMARY', 'SECONDARY', 'EXCLUDE'))
 
     # Count results
-    primary_count = (df['Filter4_Decision'] == 'PRIMARY').sum()
-    secondary_count = (df['Filter4_Decision'] == 'SECONDARY').sum()
-    excluded_count = (df['Filter4_Decision'] == 'EXCLUDE').sum()
+    primary_count = len(primary)
+    secondary_count = len(secondary)
+    excluded_count = len(excluded)
 
     # ============================================
     # DISPLAY RESULTS
@@ -206,116 +347,118 @@ def filter_study_type(input_csv='filter3_passed.csv',
     print("FILTER 4 RESULTS: STUDY TYPE CLASSIFICATION")
     print("="*80)
     print(f"\nTotal papers evaluated: {len(df):,}")
-    print(f"\n  [PRIMARY] Original Research:    {primary_count:,} ({primary_count/len(df)*100:.1f}%)")
-    print(f"  [SECONDARY] Reviews/Surveys:    {secondary_count:,} ({secondary_count/len(df)*100:.1f}%)")
-    print(f"  [EXCLUDE] Non-Research Items:   {excluded_count:,} ({excluded_count/len(df)*100:.1f}%)")
-
-    # Show breakdown of categories
-    if secondary_count > 0:
-        print("\n" + "-"*80)
-        print("Secondary Studies Breakdown:")
-        print("-"*80)
-        secondary_df = df[df['Filter4_Decision'] == 'SECONDARY']
-        category_counts = secondary_df['Filter4_Category'].value_counts()
-        for category, count in category_counts.items():
-            print(f"  {category:30s}: {count:4,} papers ({count/secondary_count*100:.1f}%)")
-
-    if excluded_count > 0:
-        print("\n" + "-"*80)
-        print("Non-Research Items Breakdown:")
-        print("-"*80)
-        excluded_df = df[df['Filter4_Decision'] == 'EXCLUDE']
-        category_counts = excluded_df['Filter4_Category'].value_counts()
-        for category, count in category_counts.items():
-            print(f"  {category:30s}: {count:4,} papers ({count/excluded_count*100:.1f}%)")
+    print(f"\n  [PRIMARY] Original Research:    {primary_count:,} ({primary_count/max(len(df), 1)*100:.1f}%)")
+    print(f"  [SECONDARY] Reviews/Surveys:    {secondary_count:,} ({secondary_count/max(len(df), 1)*100:.1f}%)")
+    print(f"  [EXCLUDE] Non-Research Items:   {excluded_count:,} ({excluded_count/max(len(df), 1)*100:.1f}%)")
+
+    # Show breakdown of categories (verbose only; value_counts on the categorical also
+    # lists the categories without papers, which are left out)
+    if verbose:
+        if secondary_count > 0:
+            print("\n" + "-"*80)
+            print("Secondary Studies Breakdown:")
+            print("-"*80)
+            category_counts = df['Filter4_Category'].iloc[secondary].value_counts()
+            category_counts = category_counts[category_counts > 0]
+            for category, count in category_counts.items():
+                print(f"  {category:30s}: {count:4,} papers ({count/secondary_count*100:.1f}%)")
+
+        if excluded_count > 0:
+            print("\n" + "-"*80)
+            print("Non-Research Items Breakdown:")
+            print("-"*80)
+            category_counts = df['Filter4_Category'].iloc[excluded].value_counts()
+            category_counts = category_counts[category_counts > 0]
+            for category, count in category_counts.items():
+                print(f"  {category:30s}: {count:4,} papers ({count/excluded_count*100:.1f}%)")
 
     # ============================================
     # EXPORT RESULTS
     # ============================================
 
-    # Select columns for output
-    output_columns = [
-        'Filter1_Decision', 'Filter1_Matched_Terms', 'Filter1_Match_Location',
-        'Filter2_Decision', 'Filter2_Matched_Terms', 'Filter2_Match_Location',
-        'Filter3_Decision', 'Filter3_Matched_Terms', 'Filter3_Match_Location',
-        'Filter4_Decision', 'Filter4_Category', 'Filter4_Matched_Terms', 'Filter4_Reason',
-        'Title', 'Authors', 'Year', 'Publication', 'Type', 'DOI', 'Abstract', 'Keywords', 'URL'
-    ]
-    output_columns = [col for col in output_columns if col in df.columns]
-
     print("\n" + "="*80)
     print("EXPORTING RESULTS")
     print("="*80)
 
-    # 1. Save all results
-    print(f"\n1. Saving all papers with Filter 4 classifications to {output_all}...")
-    df_output = df[output_columns].copy()
-    df_output = df_output.sort_values('Filter4_Decision', ascending=True)  # PRIMARY first, then SECONDARY, then EXCLUDE
-    df_output.to_csv(output_all, index=False, encoding='utf-8')
-    print(f"   [SUCCESS] {len(df_output):,} papers saved")
+    # The four files are written in one pass: each decision's rows are copied out in
+    # CHUNK_SIZE slices, and every slice goes both to the all-results file (decisions
+    # in sorted order: EXCLUDE, PRIMARY, SECONDARY) and to that decision's own file
+    column_positions = df.columns.get_indexer(output_columns)
+    with (open(output_all, 'wb') if output_all is not None else contextlib.nullcontext()) as all_file, \
+         open(output_primary, 'wb') as primary_file, open(output_secondary, 'wb') as secondary_file, \
+         open(output_exclude, 'wb') as exclude_file:
+        for i, (rows, out) in enumerate(((excluded, exclude_file), (primary, primary_file),
+                                         (secondary, secondary_file))):
+            for start in range(0, max(len(rows), 1), CHUNK_SIZE):
+                chunk = df.iloc[rows[start:start + CHUNK_SIZE], column_positions]
+                if all_file is not None:
+                    append_csv(chunk, all_file, header=i == 0 and start == 0)
+                append_csv(chunk, out, header=start == 0)
+
+    # 1. All results
+    if output_all is not None:
+        print(f"\n1. Saving all papers with Filter 4 classifications to {output_all}...")
+        print(f"   [SUCCESS] {len(df):,} papers saved")
+    else:
+        print("\n1. Skipping the all-results file (same papers as the three files below)")
 
-    # 2. Save primary research papers (MAIN DATASET)
-    df_primary = df[df['Filter4_Decision'] == 'PRIMARY'].copy()
+    # 2. Primary research papers (MAIN DATASET)
     print(f"\n2. Saving PRIMARY research papers to {output_primary}...")
-    df_primary[output_columns].to_csv(output_primary, index=False, encoding='utf-8')
-    print(f"   [SUCCESS] {len(df_primary):,} papers saved")
+    print(f"   [SUCCESS] {primary_count:,} papers saved")
     print(f"   *** THIS IS YOUR MAIN DATASET FOR LITERATURE REVIEW ***")
 
-    # 3. Save secondary studies (FLAGGED for separate review)
-    df_secondary = df[df['Filter4_Decision'] == 'SECONDARY'].copy()
+    # 3. Secondary studies (FLAGGED for separate review)
     print(f"\n3. Saving SECONDARY studies (reviews/surveys) to {output_secondary}...")
-    df_secondary[output_columns].to_csv(output_secondary, index=False, encoding='utf-8')
-    print(f"   [SUCCESS] {len(df_secondary):,} papers saved")
+    print(f"   [SUCCESS] {secondary_count:,} papers saved")
     print(f"   -> Use these for background/related work section")
 
-    # 4. Save excluded non-research items
-    df_excluded = df[df['Filter4_Decision'] == 'EXCLUDE'].copy()
+    # 4. Excluded non-research items
     print(f"\n4. Saving EXCLUDED non-research items to {output_exclude}...")
-    df_excluded[output_columns].to_csv(output_exclude, index=False, encoding='utf-8')
-    print(f"   [SUCCESS] {len(df_excluded):,} papers saved")
+    print(f"   [SUCCESS] {excluded_count:,} papers saved")
     print(f"   -> Editorials, commentaries, letters (not original research)")
 
     # ============================================
-    # SAMPLE OUTPUTS
+    # SAMPLE OUTPUTS (verbose only)
     # ============================================
 
-    print("\n" + "="*80)
-    print("SAMPLE PRIMARY RESEARCH PAPERS (showing first 5)")
-    print("="*80)
-    if primary_count > 0:
-        sample_primary = df_primary.head(5)
-        for idx, row in sample_primary.iterrows():
-            title = row['Title'][:90] + '...' if len(str(row['Title'])) > 90 else row['Title']
-            print(f"\n  Title: {title}")
-            print(f"  Category: {row['Filter4_Category']}")
-    else:
-        print("  No primary research papers found.")
-
-    print("\n" + "="*80)
-    print("SAMPLE SECONDARY STUDIES (showing first 3)")
-    print("="*80)
-    if secondary_count > 0:
-        sample_secondary = df_secondary.head(3)
-        for idx, row in sample_secondary.iterrows():
-            title = row['Title'][:80] + '...' if len(str(row['Title'])) > 80 else row['Title']
-            print(f"\n  Title: {title}")
-            print(f"  Category: {row['Filter4_Category']}")
-            print(f"  Matched: {row['Filter4_Matched_Terms'][:80]}")
-    else:
-        print("  No secondary studies found.")
-
-    print("\n" + "="*80)
-    print("SAMPLE EXCLUDED NON-RESEARCH (showing first 3)")
-    print("="*80)
-    if excluded_count > 0:
-        sample_excluded = df_excluded.head(3)
-        for idx, row in sample_excluded.iterrows():
-            title = row['Title'][:80] + '...' if len(str(row['Title'])) > 80 else row['Title']
-            print(f"\n  Title: {title}")
-            print(f"  Category: {row['Filter4_Category']}")
-            print(f"  Matched: {row['Filter4_Matched_Terms'][:80]}")
-    else:
-        print("  No non-research items excluded.")
+    if verbose:
+        print("\n" + "="*80)
+        print("SAMPLE PRIMARY RESEARCH PAPERS (showing first 5)")
+        print("="*80)
+        if primary_count > 0:
+            sample_primary = df.iloc[primary[:5]]
+            for title, category in sample_primary[['Title', 'Filter4_Category']].itertuples(index=False, name=None):
+                title = title[:90] + '...' if len(str(title)) > 90 else title
+                print(f"\n  Title: {title}")
+                print(f"  Category: {category}")
+        else:
+            print("  No primary research papers found.")
+
+        print("\n" + "="*80)
+        print("SAMPLE SECONDARY STUDIES (showing first 3)")
+        print("="*80)
+        if secondary_count > 0:
+            sample_secondary = df.iloc[secondary[:3]]
+            for title, category, terms in sample_secondary[['Title', 'Filter4_Category', 'Filter4_Matched_Terms']].itertuples(index=False, name=None):
+                title = title[:80] + '...' if len(str(title)) > 80 else title
+                print(f"\n  Title: {title}")
+                print(f"  Category: {category}")
+                print(f"  Matched: {terms[:80]}")
+        else:
+            print("  No secondary studies found.")
+
+        print("\n" + "="*80)
+        print("SAMPLE EXCLUDED NON-RESEARCH (showing first 3)")
+        print("="*80)
+        if excluded_count > 0:
+            sample_excluded = df.iloc[excluded[:3]]
+            for title, category, terms in sample_excluded[['Title', 'Filter4_Category', 'Filter4_Matched_Terms']].itertuples(index=False, name=None):
+                title = title[:80] + '...' if len(str(title)) > 80 else title
+                print(f"\n  Title: {title}")
+                print(f"  Category: {category}")
+                print(f"  Matched: {terms[:80]}")
+        else:
+            print("  No non-research items excluded.")
 
     # ============================================
     # SUMMARY
@@ -325,9 +468,9 @@ def filter_study_type(input_csv='filter3_passed.csv',
     print("FILTER 4 SUMMARY")
     print("="*80)
     print(f"\nTotal papers evaluated: {len(df):,}")
-    print(f"\nPRIMARY Research (original contributions):  {primary_count:,} ({primary_count/len(df)*100:.1f}%)")
-    print(f"SECONDARY Studies (reviews/surveys):        {secondary_count:,} ({secondary_count/len(df)*100:.1f}%)")
-    print(f"EXCLUDED Non-Research (editorials/letters): {excluded_count:,} ({excluded_count/len(df)*100:.1f}%)")
+    print(f"\nPRIMARY Research (original contributions):  {primary_count:,} ({primary_count/max(len(df), 1)*100:.1f}%)")
+    print(f"SECONDARY Studies (reviews/surveys):        {secondary_count:,} ({secondary_count/max(len(df), 1)*100:.1f}%)")
+    print(f"EXCLUDED Non-Research (editorials/letters): {excluded_count:,} ({excluded_count/max(len(df), 1)*100:.1f}%)")
 
     print("\n" + "="*80)
     print("NEXT STEPS")
@@ -355,9 +498,17 @@ if __name__ == "__main__":
     output_secondary = 'filter4_secondary_studies.csv'
     output_exclude = 'filter4_excluded.csv'
 
-    # Command-line arguments
-    if len(sys.argv) > 1:
-        input_file = sys.argv[1]
+    # Command-line arguments (--verbose also prints category breakdowns and sample papers,
+    # --minimal-columns leaves out the Filter 1-3 columns, --no-all-results skips output_all)
+    flags = [arg for arg in sys.argv[1:] if arg.startswith('--')]
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    verbose = '--verbose' in flags
+    minimal_columns = '--minimal-columns' in flags
+    if '--no-all-results' in flags:
+        output_all = None
+    if args:
+        input_file = args[0]
 
     # Run Filter 4
-    filter_study_type(input_file, output_all, output_primary, output_secondary, output_exclude)
+    filter_study_type(input_file, output_all, output_primary, output_secondary, output_exclude,
+                      verbose=verbose, minimal_columns=minimal_columns)
@@ -0,0 +1,218 @@
+"""
+PRISMA Filters 1-3 in one pass: Exclusion Check, ICD Relevance, Automation/AI Relevance
+Same decisions as running step7_filter1, step7_filter2 and step7_filter3 one after another,
+but the papers are loaded and their Title/Abstract/Keywords lowercased only once
+
+Input: prisma_screening_results_all_filtered.csv (papers filtered by year 2005-2026 and type CONF/JOUR)
+Output: Papers that passed all three filters (input for Filter 4: Study Type) plus one file
+        with every paper and its Filter 1-3 decisions
+"""
+
+import os
+import pandas as pd
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from pipeline_utils import get_text_columns, parquet_path, read_csv_file
+from step7_filter1_exclusion_check import check_exclusion_criteria
+from step7_filter2_icd_relevance import DECISION_DTYPE, check_icd_text
+from step7_filter3_automation_relevance import check_automation_text
+
+try:
+    import pyarrow as pa
+except ImportError:  # pyarrow enables the Parquet intermediates
+    pa = None
+
+# ============================================
+# OUTPUT COLUMNS
+# ============================================
+
+FILTER1_COLUMNS = ['Filter1_Decision', 'Filter1_Matched_Exclusions', 'Filter1_Reason']
+FILTER2_COLUMNS = ['Filter2_Decision', 'Filter2_Matched_Terms', 'Filter2_Match_Location', 'Filter2_Reason']
+FILTER3_COLUMNS = ['Filter3_Decision', 'Filter3_Matched_Terms', 'Filter3_Match_Location', 'Filter3_Reason']
+PAPER_COLUMNS = ['Title', 'Authors', 'Year', 'Publication', 'Type', 'DOI', 'Abstract', 'Keywords', 'URL']
+
+# ============================================
+# HELPER FUNCTIONS
+# ============================================
+
+def check_all_filters(df):
+    """
+    Run Filters 1-3 on a block of papers, lowercasing the text fields once
+    Filter 2 only sees the papers that passed Filter 1, Filter 3 those that passed Filter 2
+    Returns: DataFrame with the Filter 1-3 columns (Filter 2/3 empty where not reached)
+    """
+    title, abstract, keywords = get_text_columns(df)
+
+    filter1 = pd.DataFrame([check_exclusion_criteria(*fields) for fields in zip(title, abstract, keywords)],
+                           index=df.index, columns=FILTER1_COLUMNS)
+    filter1['Filter1_Decision'] = filter1['Filter1_Decision'].astype(DECISION_DTYPE)
+    passed1 = (filter1['Filter1_Decision'] == 'PASS').to_numpy()
+
+    filter2 = pd.DataFrame(dict(zip(FILTER2_COLUMNS, check_icd_text(title[passed1], abstract[passed1],
+                                                                    keywords[passed1]))))
+    passed2 = filter2.index[filter2['Filter2_Decision'] == 'PASS']
+
+    filter3 = pd.DataFrame(dict(zip(FILTER3_COLUMNS, check_automation_text(title[passed2], abstract[passed2],
+                                                                           keywords[passed2]))))
+
+    return pd.concat([filter1, filter2, filter3], axis=1)
+
+def apply_all_filters(df, n_jobs=None):
+    """
+    Run check_all_filters over n_jobs row blocks in parallel
+    Returns: DataFrame with the Filter 1-3 columns
+    """
+    n_jobs = n_jobs or os.cpu_count() or 1
+    text_df = df[[col for col in ('Title', 'Abstract', 'Keywords') if col in df.columns]]
+    if n_jobs == 1 or len(df) < 2 * n_jobs:
+        return check_all_filters(text_df)
+
+    blocks = [text_df.iloc[idx] for idx in np.array_split(np.arange(len(df)), n_jobs)]
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        return pd.concat(executor.map(check_all_filters, blocks))
+
+# ============================================
+# MAIN FILTERING FUNCTION
+# ============================================
+
+def filter_combined(input_csv='prisma_screening_results_all_filtered.csv',
+                    output_all='filters1-3_all_results.csv',
+                    output_pass='filter3_passed.csv',
+                    output_exclude='filters1-3_excluded.csv',
+                    n_jobs=None, decisions_only=False):
+    """
+    Filters 1-3: Exclusion check, ICD relevance and Automation/AI relevance in one pass
+
+    Parameters:
+    - input_csv: Input CSV file (papers filtered by year 2005-2026 and type CONF/JOUR)
+    - output_all: Complete results with all papers and Filter 1-3 decisions
+    - output_pass: Papers that PASSED all three filters - proceed to Filter 4
+    - output_exclude: Papers that were EXCLUDED by any of the three filters
+    - n_jobs: Worker processes for the keyword checks (default: all CPU cores)
+    - decisions_only: Write only the row key (Row, DOI) and the Filter 1-3 columns to output_all
+    """
+
+    print("="*80)
+    print("PRISMA FILTERS 1-3: EXCLUSION, ICD RELEVANCE, AUTOMATION/AI RELEVANCE")
+    print("="*80)
+    print("\nFilter 1: Paper MUST NOT contain exclusion keywords (non-medical ICD)")
+    print("Filter 2: Paper MUST mention ICD coding/classification")
+    print("Filter 3: Paper MUST mention automation/AI/ML methods")
+
+    # Load data
+    print(f"\nLoading data from {input_csv}...")
+    df = read_csv_file(input_csv)  # pyarrow's multithreaded CSV parser when installed
+    print(f"Total records loaded: {len(df):,}")
+    print("(Papers after year and publication type filtering)")
+
+    # ============================================
+    # APPLY FILTERS 1-3
+    # ============================================
+
+    print("\n" + "-"*80)
+    print("Applying Filters 1-3...")
+    print("-"*80)
+
+    df = df.join(apply_all_filters(df, n_jobs))
+
+    # Count results (each filter only counts the papers that reached it)
+    passed = df['Filter3_Decision'].eq('PASS').to_numpy()
+    stage_counts = []
+    for number, name in ((1, 'Exclusion Check'), (2, 'ICD Relevance'), (3, 'Automation/AI Relevance')):
+        decisions = df[f'Filter{number}_Decision']
+        stage_counts.append((number, name, int(decisions.notna().sum()),
+                             int(decisions.eq('PASS').sum()), int(decisions.eq('EXCLUDE').sum())))
+
+    # ============================================
+    # DISPLAY RESULTS
+    # ============================================
+
+    print("\n" + "="*80)
+    print("FILTERS 1-3 RESULTS")
+    print("="*80)
+    print(f"\nTotal papers evaluated: {len(df):,}")
+    for number, name, evaluated, passed_count, excluded_count in stage_counts:
+        print(f"\n  Filter {number}: {name} ({evaluated:,} papers evaluated)")
+        print(f"    [PASS] PASSED:      {passed_count:,} ({passed_count/max(evaluated, 1)*100:.1f}%)")
+        print(f"    [EXCLUDE] EXCLUDED: {excluded_count:,} ({excluded_count/max(evaluated, 1)*100:.1f}%)")
+
+    # ============================================
+    # EXPORT RESULTS
+    # ============================================
+
+    output_columns = FILTER1_COLUMNS + FILTER2_COLUMNS + FILTER3_COLUMNS + PAPER_COLUMNS
+    output_columns = [col for col in output_columns if col in df.columns]
+
+    print("\n" + "="*80)
+    print("EXPORTING RESULTS")
+    print("="*80)
+
+    df_passed = df.loc[passed, output_columns]
+    df_excluded = df.loc[~passed, output_columns]
+
+    # 1. Save all results (PASS first), or only the decisions keyed by input row
+    #    (Row) and DOI, so the paper columns are not written a second time
+    print(f"\n1. Saving all papers with Filter 1-3 decisions to {output_all}...")
+    if decisions_only:
+        key_columns = [col for col in ['DOI'] if col in df.columns]
+        df[key_columns + FILTER1_COLUMNS + FILTER2_COLUMNS + FILTER3_COLUMNS].to_csv(
+            output_all, index_label='Row', encoding='utf-8')
+    else:
+        df_passed.to_csv(output_all, index=False, encoding='utf-8')
+        df_excluded.to_csv(output_all, mode='a', header=False, index=False, encoding='utf-8')
+    print(f"   [SUCCESS] {len(df):,} papers saved")
+
+    # 2. Save passed papers
+    print(f"\n2. Saving papers that PASSED Filters 1-3 to {output_pass}...")
+    df_passed.to_csv(output_pass, index=False, encoding='utf-8')
+    if pa is not None:
+        # Filter 4 reads this Parquet copy instead of re-parsing the CSV
+        df_passed.to_parquet(parquet_path(output_pass), compression='snappy', index=False)
+    print(f"   [SUCCESS] {len(df_passed):,} papers saved")
+    print("   -> These papers proceed to Filter 4 (Study Type)")
+
+    # 3. Save excluded papers
+    print(f"\n3. Saving papers EXCLUDED by Filters 1-3 to {output_exclude}...")
+    df_excluded.to_csv(output_exclude, index=False, encoding='utf-8')
+    print(f"   [SUCCESS] {len(df_excluded):,} papers saved")
+    print("   -> The FilterN_Decision columns show which filter excluded each paper")
+
+    # ============================================
+    # SUMMARY
+    # ============================================
+
+    print("\n" + "="*80)
+    print("NEXT STEPS")
+    print("="*80)
+    print(f"1. Review {output_all} to see all filtering decisions")
+    print(f"2. Use {output_pass} as input for Filter 4 (Study Type)")
+    print(f"3. Archive {output_exclude}")
+    print("\nFilters 1-3 Complete!")
+    print("="*80)
+
+    return df
+
+# ============================================
+# MAIN EXECUTION
+# ============================================
+
+if __name__ == "__main__":
+    import sys
+
+    # Default parameters
+    input_file = 'prisma_screening_results_all_filtered.csv'
+    output_all = 'filters1-3_all_results.csv'
+    output_pass = 'filter3_passed.csv'
+    output_exclude = 'filters1-3_excluded.csv'
+
+    # Command-line arguments (--decisions-only writes only the row key and
+    # decisions to the all-results file)
+    flags = [arg for arg in sys.argv[1:] if arg.startswith('--')]
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    decisions_only = '--decisions-only' in flags
+    if args:
+        input_file = args[0]
+
+    # Run Filters 1-3
+    filter_combined(input_file, output_all, output_pass, output_exclude, decisions_only=decisions_only)
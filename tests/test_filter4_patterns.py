@@ -0,0 +1,115 @@
+"""
+Filter 4 keyword patterns: the pruned patterns classify papers as the original
+ones did, and no pattern backtracks badly on long adversarial texts
+"""
+
+import os
+import re
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import step7_filter4_study_type as filter4
+from pipeline_utils import lower_pattern
+
+# The patterns as they were before the redundant alternatives were dropped
+ORIGINAL_SECONDARY_KEYWORDS = dict(filter4.SECONDARY_STUDY_KEYWORDS, **{
+    'Review Article': r'\b(?:review of|review on|a review of) (?:automated|automatic|machine learning|deep learning|AI|methods|approaches|techniques|algorithms)\b',
+})
+ORIGINAL_NON_RESEARCH_KEYWORDS = dict(filter4.NON_RESEARCH_KEYWORDS, **{
+    'Editorial': r'\b(?:editorial|^editorial)\b',
+    'Commentary': r'\b(?:commentary|^commentary)\b',
+    'Viewpoint': r'\b(?:viewpoint|^viewpoint)\b',
+    'Preface': r'\bpreface(?: to)?\b',
+})
+
+SAMPLE_TITLES = [
+    'Editorial',
+    'Editorial: automated ICD coding',
+    'An editorial on clinical coding',
+    'Editorials and letters',
+    'Commentary on deep learning for ICD coding',
+    'A commentary',
+    'Viewpoint: the future of medical coding',
+    'Viewpoints on coding',
+    'Preface',
+    'Preface to the special issue on clinical NLP',
+    'Prefaced by the editors',
+    'A review of automated ICD coding',
+    'A review of methods for clinical coding',
+    'Review of deep learning approaches',
+    'A review on machine learning for ICD coding',
+    'A review of the literature',
+    'Peer review of coding audits',
+    'Survey study of clinical coders',
+    'A survey of automated ICD coding',
+    'Automated ICD coding with transformers',
+    '',
+]
+
+
+def classify(titles):
+    df = pd.DataFrame({'Title': titles, 'Abstract': 'We code discharge summaries.', 'Type': 'Journal'})
+    decision, category, matched_terms, reason = filter4.classify_study_type(df)
+    return pd.DataFrame({'decision': decision, 'category': category, 'matched_terms': matched_terms})
+
+
+def test_pruned_patterns_match_as_before():
+    pairs = [(ORIGINAL_SECONDARY_KEYWORDS, filter4.SECONDARY_STUDY_KEYWORDS),
+             (ORIGINAL_NON_RESEARCH_KEYWORDS, filter4.NON_RESEARCH_KEYWORDS)]
+    for original_keywords, keywords in pairs:
+        for name, pattern in keywords.items():
+            original = re.compile(lower_pattern(original_keywords[name]))
+            pruned = re.compile(lower_pattern(pattern))
+            for title in SAMPLE_TITLES:
+                text = title.lower()
+                assert bool(original.search(text)) == bool(pruned.search(text)), (name, title)
+
+
+def test_pruned_patterns_classify_as_before(monkeypatch):
+    pruned = classify(SAMPLE_TITLES)
+
+    secondary_regexes = [lower_pattern(pattern) for pattern in ORIGINAL_SECONDARY_KEYWORDS.values()]
+    non_research_regexes = [lower_pattern(pattern) for pattern in ORIGINAL_NON_RESEARCH_KEYWORDS.values()]
+    monkeypatch.setattr(filter4, 'SECONDARY_REGEXES', secondary_regexes)
+    monkeypatch.setattr(filter4, 'NON_RESEARCH_REGEXES', non_research_regexes)
+    monkeypatch.setattr(filter4, 'SECONDARY_PATTERN', '|'.join(f'(?:{pattern})' for pattern in secondary_regexes))
+    monkeypatch.setattr(filter4, 'NON_RESEARCH_PATTERN', '|'.join(f'(?:{pattern})' for pattern in non_research_regexes))
+    monkeypatch.setattr(filter4, 'SECONDARY_SET', None)
+    monkeypatch.setattr(filter4, 'NON_RESEARCH_SET', None)
+    original = classify(SAMPLE_TITLES)
+
+    pd.testing.assert_frame_equal(pruned, original)
+    assert pruned['decision'].tolist()[:3] == ['EXCLUDE'] * 3
+    assert pruned['decision'].tolist()[-2:] == ['PRIMARY', 'PRIMARY']
+
+
+def test_patterns_worst_case_time():
+    # Long texts built from near-matches of the keywords; Python's re (the engine
+    # without pyarrow) must stay linear on them
+    adversarial_texts = [
+        'review ' * 20_000,
+        'a review of ' * 20_000,
+        'survey of the ' * 20_000,
+        'state-of-the-art survey ' * 20_000,
+        'recent advances in ' * 20_000,
+        'authors ' * 20_000,
+        'author s ' * 20_000,
+        'letter to the ' * 20_000,
+        'correspondence to the ' * 20_000,
+        'news ' * 20_000,
+        'preface ' * 20_000,
+        'a' * 200_000,
+    ]
+    patterns = (filter4.SECONDARY_REGEXES + filter4.NON_RESEARCH_REGEXES
+                + [filter4.SECONDARY_PATTERN, filter4.NON_RESEARCH_PATTERN])
+    for pattern in patterns:
+        search = re.compile(pattern).search
+        for text in adversarial_texts:
+            start = time.perf_counter()
+            search(text)
+            elapsed = time.perf_counter() - start
+            assert elapsed < 0.5, (pattern, text[:30], elapsed)
@@ -0,0 +1,41 @@
+"""
+Regression test: input CSVs whose quoted abstracts contain line breaks
+(pyarrow splits the file into ~1 MB blocks, so such fields must not end a block)
+"""
+
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pipeline_utils import read_csv_file
+
+
+def write_multiline_csv(path, n_rows=20_000):
+    abstract = 'Background: automated ICD coding.\nMethods: a "deep learning" model,\n\nwith notes.'
+    pd.DataFrame({
+        'Title': [f'Paper {i}' for i in range(n_rows)],
+        'Year': ['2019'] * n_rows,
+        'Abstract': [f'{abstract} {i}' for i in range(n_rows)],
+        'Keywords': [None] * n_rows,
+    }).to_csv(path, index=False)
+
+
+def test_read_csv_file_quoted_newlines(tmp_path):
+    path = tmp_path / 'papers.csv'
+    write_multiline_csv(path)
+    assert os.path.getsize(path) > 2_000_000  # spans several pyarrow blocks
+
+    df = read_csv_file(path)
+    pd.testing.assert_frame_equal(df, pd.read_csv(path, low_memory=False))
+    assert df['Abstract'].str.contains('\n').all()
+
+
+def test_read_csv_file_as_strings(tmp_path):
+    path = tmp_path / 'papers.csv'
+    write_multiline_csv(path)
+
+    df = read_csv_file(path, ['Title', 'Year', 'Abstract', 'Keywords'], as_strings=True)
+    pd.testing.assert_frame_equal(df, pd.read_csv(path, dtype=str))